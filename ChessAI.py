@@ -0,0 +1,216 @@
+'''
+Computer player: negamax search with alpha-beta pruning over GameLogic's make_move/undo_move.
+- iterative deepening, stopped by a time or node budget (the last finished depth is kept)
+- move ordering: principal variation move, captures by MVV-LVA, killer moves, history heuristic, the moves come
+  from GameLogic's staged generator so the quiet moves are only generated when the first moves don't cut off
+- quiescence search over captures at the leaves, generated without the quiet moves
+- repetitions, the fifty-move rule and insufficient material score as draws without searching further
+- with an endgame tablebase (ChessTablebase.Tablebase), positions in the tables get their exact score without searching
+'''
+import time
+from ChessEvaluation import PIECE_VALUES
+
+CHECKMATE = 100000 # score of a mate at the root, mates further away score a bit less
+MAX_PLY = 128
+
+class SearchTimeout(Exception):
+    ''' raised inside the search when the time or node budget runs out '''
+
+class SearchResult:
+    def __init__(self,bestMove,score,depth,pv,nodes,seconds):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth # last depth that was searched completely
+        self.pv = pv # principal variation, the best line of play found
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = nodes / seconds if seconds > 0 else 0
+
+class Search:
+    def __init__(self,gl,maxDepth=4,timeLimit=None,nodeLimit=None,tablebase=None):
+        self.gl = gl
+        self.tablebase = tablebase
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit # seconds
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.killers = [[None,None] for _ in range(MAX_PLY)] # 2 quiet moves per ply that caused a beta cutoff
+        self.history = {} # (piece, end square) -> bonus of quiet moves that caused cutoffs
+        self.pvTable = [[] for _ in range(MAX_PLY + 1)]
+        self.previousPV = []
+        self.stopRequested = False # set by stop() (from another thread) to end the search at the next node
+        self.onDepth = None # called with the SearchResult of every finished depth
+
+    ''' iterative deepening: search depth 1, 2, ... until maxDepth or the budget runs out'''
+    def findBestMove(self):
+        gl = self.gl
+        self.nodes = 0
+        self.startTime = time.perf_counter()
+        self.stopped = False
+        # getValidMoves flags the mates it sees in the tree, keep the flags of the real position
+        checkMate, staleMate = gl.checkMate, gl.staleMate
+        rootPly = len(gl.moveLog)
+        if self.tablebase is not None:
+            found = self.tablebase.bestMove(gl)
+            if found is not None: # the tables know the result, play the move that keeps it best
+                move, result, plies = found
+                result = SearchResult(move,tablebaseScore(result,plies,0),1,[move],1,time.perf_counter() - self.startTime)
+                if self.onDepth is not None:
+                    self.onDepth(result)
+                return result
+        result = None
+        try:
+            for depth in range(1,self.maxDepth + 1):
+                score = self.negamax(depth,-CHECKMATE - 1,CHECKMATE + 1,0)
+                pv = list(self.pvTable[0])
+                self.previousPV = pv
+                result = SearchResult(pv[0] if pv else None,score,depth,pv,self.nodes,time.perf_counter() - self.startTime)
+                if self.onDepth is not None:
+                    self.onDepth(result)
+                if abs(score) >= CHECKMATE - MAX_PLY: # found a forced mate, no need to look deeper
+                    break
+        except SearchTimeout:
+            self.stopped = True
+            while len(gl.moveLog) > rootPly: # take back the moves of the unfinished search
+                gl.undo_move()
+        gl.checkMate, gl.staleMate = checkMate, staleMate
+        if result is None: # not even depth 1 finished, play the first valid move
+            moves = gl.getValidMoves()
+            gl.checkMate, gl.staleMate = checkMate, staleMate
+            bestMove = moves[0] if moves else None
+            result = SearchResult(bestMove,0,0,[bestMove] if bestMove else [],self.nodes,time.perf_counter() - self.startTime)
+        return result
+
+    ''' end the search as soon as possible, findBestMove returns the result of the last finished depth'''
+    def stop(self):
+        self.stopRequested = True
+
+    def checkBudget(self):
+        if self.stopRequested:
+            raise SearchTimeout()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchTimeout()
+        if self.timeLimit is not None and self.nodes & 1023 == 0 and time.perf_counter() - self.startTime >= self.timeLimit:
+            raise SearchTimeout()
+
+    def negamax(self,depth,alpha,beta,ply):
+        self.nodes += 1
+        self.checkBudget()
+        self.pvTable[ply] = []
+        if depth <= 0:
+            return self.quiescence(alpha,beta,ply)
+        gl = self.gl
+        if ply > 0 and self.isDraw():
+            return 0
+        if self.tablebase is not None and ply > 0:
+            found = self.tablebase.probe(gl)
+            if found is not None:
+                return tablebaseScore(found[0],found[1],ply)
+        if ply >= MAX_PLY - 1:
+            return gl.evaluate()
+        pvMove = self.previousPV[ply] if ply < len(self.previousPV) else None
+        searched = 0
+        for move in gl.generateMovesStaged(pvMove,self.captureScore,self.quietScore(ply)):
+            searched += 1
+            gl.make_move(move)
+            score = -self.negamax(depth - 1,-beta,-alpha,ply + 1)
+            gl.undo_move()
+            if score > alpha:
+                alpha = score
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                if alpha >= beta:
+                    if move.pieceCaptured == '--': # remember quiet moves that refute the opponent's move
+                        killers = self.killers[ply]
+                        if killers[0] != move:
+                            killers[1] = killers[0]
+                            killers[0] = move
+                        key = (move.pieceMoved,move.endRow,move.endCol)
+                        self.history[key] = self.history.get(key,0) + depth * depth
+                    break
+        if searched == 0:
+            return -(CHECKMATE - ply) if gl.inCheck() else 0
+        return alpha
+
+    '''
+    draw by the rules in the search: a position repeated once (playing on to the third time can't change the result),
+    the fifty-move rule, and insufficient material (only checked after a capture, the material doesn't change otherwise)
+    '''
+    def isDraw(self):
+        gl = self.gl
+        if gl.isFiftyMoveRule() or gl.isRepetition(2):
+            return True
+        return gl.moveLog[-1].pieceCaptured != '--' and gl.isInsufficientMaterial()
+
+    '''
+    only look at captures (and promotions) until the position is quiet, so the evaluation isn't taken in the middle of an exchange.
+    In check every evasion is searched, so a mate at the horizon scores as a mate and not as the evaluation.
+    '''
+    def quiescence(self,alpha,beta,ply):
+        gl = self.gl
+        if ply >= MAX_PLY - 1:
+            return gl.evaluate()
+        inCheck = gl.inCheck()
+        if inCheck: # no standing pat in check, every evasion is searched (captures first, the rest only if needed)
+            moves = gl.generateMovesStaged(captureKey=self.captureScore)
+        else:
+            standPat = gl.evaluate() # material and piece-square score kept up to date by make_move
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = gl.getCaptureMoves() # only captures and promotions are generated, no quiet moves
+            moves.sort(key=self.captureScore,reverse=True)
+        searched = 0
+        for move in moves:
+            searched += 1
+            self.nodes += 1
+            self.checkBudget()
+            gl.make_move(move)
+            score = -self.quiescence(-beta,-alpha,ply + 1)
+            gl.undo_move()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        if inCheck and searched == 0: # no evasion
+            return -(CHECKMATE - ply)
+        return alpha
+
+    ''' MVV-LVA: most valuable victim first, then least valuable attacker'''
+    def captureScore(self,move):
+        score = 10 * PIECE_VALUES[move.pieceCaptured[1]] - PIECE_VALUES[move.pieceMoved[1]] if move.pieceCaptured != '--' else 0
+        if move.isPawnPromotion:
+            score += PIECE_VALUES[move.promotionChoice]
+        return score
+
+    ''' ordering key of the quiet moves of a ply: killer moves, then the history heuristic'''
+    def quietScore(self,ply):
+        killers = self.killers[ply]
+        history = self.history
+        def moveScore(move):
+            if move == killers[0]:
+                return (1 << 19) + 1
+            if move == killers[1]:
+                return 1 << 19
+            return history.get((move.pieceMoved,move.endRow,move.endCol),0)
+        return moveScore
+
+''' score of a tablebase result (from ChessTablebase.probe) found at ply, on the same scale as the mates of the search'''
+def tablebaseScore(result,plies,ply):
+    if result > 0:
+        return CHECKMATE - ply - plies
+    if result < 0:
+        return -(CHECKMATE - ply - plies)
+    return 0
+
+'''
+search the position of gl and return a SearchResult (bestMove, score, depth, pv, nodes, nps).
+With an opening book (ChessBook.OpeningBook) a book move is played without searching (depth 0),
+with a tablebase (ChessTablebase.Tablebase) the endgames in its tables are played from the tables.
+'''
+def findBestMove(gl,maxDepth=4,timeLimit=None,nodeLimit=None,book=None,tablebase=None):
+    if book is not None:
+        move = book.choose(gl)
+        if move is not None:
+            return SearchResult(move,0,0,[move],0,0)
+    return Search(gl,maxDepth,timeLimit,nodeLimit,tablebase).findBestMove()
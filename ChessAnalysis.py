@@ -0,0 +1,243 @@
+'''
+Batch analysis service: analyse a stream of positions on a pool of worker processes.
+A position is a FEN string, a list of moves played from the starting position, or a (FEN, moves) pair.
+Moves can be in coordinate notation (e2e4, e7e8q) or SAN (Nf3, exd8=N+).
+Every worker keeps one GameLogic and sets it up with load_fen for each position, positions are sent in chunks
+to cut the cost of passing them between processes, and results come back in the order of the input.
+At most maxInFlight chunks are queued at a time, so the input is only read as fast as the workers take it
+and an input of millions of positions never sits in memory.
+
+usage: python ChessAnalysis.py positions.txt [--workers N] [--chunk-size N] [--depth N] [--tablebase DIR]
+       (one FEN per line, JSON lines out)
+       python ChessAnalysis.py --self-check
+'''
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import ChessAI
+from ChessParallel import BACKENDS
+
+TABLEBASE_RESULTS = {1:'win',0:'draw',-1:'loss'} # ChessTablebase WIN, DRAW, LOSS
+
+''' WORKER SIDE '''
+_workerLogic = None
+_workerOptions = None
+_tablebases = {} # directory -> ChessTablebase.Tablebase opened in this process
+
+def initWorker(backend,options):
+    global _workerLogic, _workerOptions
+    _workerLogic = BACKENDS[backend]()
+    _workerLogic.underPromotions = True
+    _workerOptions = options
+
+''' the move of the position of gl written as notation, in coordinate notation or SAN'''
+def findMove(gl,notation,moves):
+    for move in moves:
+        if move.getChessNotation() == notation:
+            return move
+    return gl.parseSAN(notation,moves)
+
+''' set up gl on a position: FEN string, list of moves from the start, or (FEN, moves)'''
+def setupPosition(gl,position):
+    if isinstance(position,str):
+        gl.load_fen(position)
+        return
+    if len(position) == 2 and (position[0] is None or isinstance(position[0],str)) and not isinstance(position[1],str):
+        fen, moves = position
+    else:
+        fen, moves = None, position
+    gl.load_fen(fen or ChessEngine.STARTING_FEN)
+    for notation in moves:
+        gl.make_move(findMove(gl,notation,gl.getValidMoves()))
+
+def openTablebase(directory):
+    if directory not in _tablebases:
+        import ChessTablebase
+        _tablebases[directory] = ChessTablebase.Tablebase(directory)
+    return _tablebases[directory]
+
+'''
+{'fen', 'moves', 'check', 'checkMate', 'staleMate', 'state'} of a position, plus {'score', 'bestMove', 'depth', 'nodes'}
+when options has a search depth. A position that can't be set up or analysed gives {'error'}, so one bad position
+doesn't end the batch (the next position sets gl up again from scratch).
+With a tablebase directory in options, positions in its tables also get {'tablebase': win/draw/loss, 'dtm': plies}.
+'''
+def analyzePosition(gl,position,options):
+    try:
+        setupPosition(gl,position)
+        return positionReport(gl,options)
+    except Exception as error:
+        return {'error':'{}: {}'.format(type(error).__name__,error)}
+
+def positionReport(gl,options):
+    moves = gl.getValidMoves()
+    check = gl.inCheck()
+    result = {'fen':gl.to_fen(),'moves':[move.getChessNotation() for move in moves],'check':check,
+              'checkMate':check and len(moves) == 0,'staleMate':not check and len(moves) == 0,
+              'state':gl.getGameState(moves)}
+    tablebase = openTablebase(options['tablebase']) if options.get('tablebase') else None
+    if tablebase is not None:
+        found = tablebase.probe(gl)
+        if found is not None:
+            result['tablebase'] = TABLEBASE_RESULTS[found[0]]
+            result['dtm'] = found[1]
+    depth = options.get('depth')
+    if depth:
+        search = ChessAI.Search(gl,depth,options.get('timeLimit'),options.get('nodeLimit'),tablebase).findBestMove()
+        result['score'] = search.score
+        result['bestMove'] = search.bestMove.getChessNotation() if search.bestMove else None
+        result['depth'] = search.depth
+        result['nodes'] = search.nodes
+    return result
+
+def analyzeChunk(chunk):
+    return [analyzePosition(_workerLogic,position,_workerOptions) for position in chunk]
+
+''' MAIN PROCESS SIDE '''
+class BatchAnalyzer:
+    '''
+    workers: number of processes (None for one per core, 0 to analyse in this process)
+    chunkSize: positions sent to a worker at a time, maxInFlight: chunks queued at most (default 2 per worker)
+    depth, timeLimit, nodeLimit: search each position too (depth None or 0 only lists the moves)
+    tablebase: directory of endgame tables, probed for every position and used by the search
+    '''
+    def __init__(self,workers=None,chunkSize=256,maxInFlight=None,backend='mailbox',depth=None,timeLimit=None,nodeLimit=None,
+                 tablebase=None):
+        if chunkSize < 1:
+            raise ValueError('chunkSize must be at least 1')
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunkSize = chunkSize
+        self.maxInFlight = maxInFlight or 2 * max(self.workers,1)
+        self.backend = backend
+        self.options = {'depth':depth,'timeLimit':timeLimit,'nodeLimit':nodeLimit,'tablebase':tablebase}
+        self.executor = None
+        self.resetStats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def resetStats(self):
+        self.positions = 0
+        self.errors = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self.waitSeconds = 0.0 # time spent waiting on the workers for the next result
+        self.peakInFlight = 0
+
+    def stats(self):
+        return {'positions':self.positions,'errors':self.errors,'chunks':self.chunks,'seconds':self.seconds,
+                'positionsPerSecond':self.positions / self.seconds if self.seconds > 0 else 0,
+                'waitSeconds':self.waitSeconds,'peakInFlight':self.peakInFlight,
+                'workers':self.workers,'chunkSize':self.chunkSize}
+
+    ''' split the positions in lists of chunkSize, reading them lazily'''
+    def splitChunks(self,positions):
+        chunk = []
+        for position in positions:
+            chunk.append(position)
+            if len(chunk) == self.chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def countResults(self,results):
+        self.chunks += 1
+        self.positions += len(results)
+        self.errors += sum(1 for result in results if 'error' in result)
+
+    ''' yield the result of every position, in input order'''
+    def analyze(self,positions):
+        start = time.perf_counter()
+        try:
+            if self.workers == 0:
+                yield from self.analyzeLocally(positions)
+                return
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,initializer=initWorker,
+                                                    initargs=(self.backend,self.options))
+            pending = collections.deque()
+            for chunk in self.splitChunks(positions):
+                pending.append(self.executor.submit(analyzeChunk,chunk))
+                self.peakInFlight = max(self.peakInFlight,len(pending))
+                if len(pending) >= self.maxInFlight: # wait for the oldest chunk before reading more input
+                    yield from self.collect(pending.popleft())
+            while pending:
+                yield from self.collect(pending.popleft())
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def collect(self,future):
+        waitStart = time.perf_counter()
+        results = future.result()
+        self.waitSeconds += time.perf_counter() - waitStart
+        self.countResults(results)
+        return results
+
+    def analyzeLocally(self,positions):
+        gl = BACKENDS[self.backend]()
+        gl.underPromotions = True
+        for chunk in self.splitChunks(positions):
+            results = [analyzePosition(gl,position,self.options) for position in chunk]
+            self.countResults(results)
+            yield from results
+
+''' analyse positions with a new BatchAnalyzer, results in input order'''
+def analyzePositions(positions,**options):
+    with BatchAnalyzer(**options) as analyzer:
+        yield from analyzer.analyze(positions)
+
+'''
+analyse a batch with a position the move generator fails on (a black pawn on the first rank) and one that
+can't be set up in the middle, in this process and on the workers. Returns True when both give the same results,
+with an error record for each bad position and the positions after them analysed.
+'''
+def selfCheck():
+    positions = [ChessEngine.STARTING_FEN,'4k3/8/8/8/8/8/8/p3K3 b - - 0 1',['e2e4','e7e5'],['e2e5'],
+                 '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1']
+    ok = True
+    for workers in (0,2):
+        results = list(analyzePositions(positions,workers=workers,chunkSize=2,depth=1))
+        ok = ok and [('error' in result) for result in results] == [False,True,False,True,False]
+        ok = ok and results[2]['fen'] == 'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2'
+        ok = ok and len(results[4]['moves']) == 6 and results[4]['bestMove'] is not None
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse the positions of a file (one FEN per line) and print a JSON line per position')
+    parser.add_argument('positions',nargs='?')
+    parser.add_argument('--workers',type=int,default=None,help='worker processes (default one per CPU core, 0 to run in this process)')
+    parser.add_argument('--chunk-size',type=int,default=256)
+    parser.add_argument('--backend',choices=sorted(BACKENDS),default='mailbox')
+    parser.add_argument('--depth',type=int,default=0,help='also search every position to this depth')
+    parser.add_argument('--tablebase',help='endgame tablebase directory (made with ChessTablebase.py build)')
+    parser.add_argument('--self-check',action='store_true',help='analyse a batch with bad positions in it and check the results')
+    args = parser.parse_args(argv)
+    if args.self_check:
+        ok = selfCheck()
+        print('OK' if ok else 'FAILED')
+        return 0 if ok else 1
+    if args.positions is None:
+        parser.error('the positions file is required')
+    with open(args.positions) as f, BatchAnalyzer(args.workers,args.chunk_size,backend=args.backend,depth=args.depth,
+                                                  tablebase=args.tablebase) as analyzer:
+        lines = (line.strip() for line in f)
+        for result in analyzer.analyze(line for line in lines if line):
+            sys.stdout.write(json.dumps(result) + '\n')
+        sys.stderr.write(json.dumps(analyzer.stats()) + '\n')
+    return 0
+
+if __name__ == '__main__':sys.exit(main())
@@ -0,0 +1,245 @@
+'''
+Compact binary format for positions and games, to archive games and pass them between processes.
+- a position is 32 bytes: 64 bit occupancy of the board (bit row*8+col), 4 bits per piece in square order
+  (16 bytes for up to 32 pieces), side to move + castling rights (1 byte), enpassant column + 1 (1 byte),
+  halfmove clock and fullmove number (2 bytes each), 2 bytes padding
+- a move is its 16 bit code (Move.encode), a game is its start position, the number of moves and the move codes
+- a game file is a header, the games one after the other and an index of where each game starts, so the file
+  can be memory mapped and a game read by its number without reading the ones before it
+
+Everything is little endian. Move codes are read as a memoryview over the bytes (no copy) on little endian machines, games read from an
+archive are copied out of the memory map first so the archive can be closed while they are still used.
+'''
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+import ChessEngine
+
+PIECE_CODES = ['wp','wN','wB','wR','wQ','wK','bp','bN','bB','bR','bQ','bK']
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECE_CODES)}
+MAX_PIECES = 32
+
+POSITION_FORMAT = struct.Struct('<Q16sBBHH2x')
+POSITION_SIZE = POSITION_FORMAT.size # 32
+GAME_HEADER = struct.Struct('<H') # number of moves, after the start position
+MAGIC = b'CHSG'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHQQ') # magic, version, reserved, number of games, offset of the index
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+''' POSITIONS '''
+''' the position of gl in 32 bytes'''
+def packPosition(gl):
+    occupancy = 0
+    nibbles = []
+    for r in range(8):
+        row = gl.board[r]
+        for c in range(8):
+            piece = row[c]
+            if piece != '--':
+                occupancy |= 1 << (r*8 + c)
+                nibbles.append(PIECE_INDEX[piece])
+    if len(nibbles) > MAX_PIECES:
+        raise ValueError('a packed position holds at most {} pieces'.format(MAX_PIECES))
+    if len(nibbles) & 1:
+        nibbles.append(0)
+    pieces = bytes(nibbles[i] | nibbles[i + 1] << 4 for i in range(0,len(nibbles),2))
+    flags = gl.whiteToMove | gl.currentCastlingRights.mask() << 1
+    enpassant = gl.enpassantPossible[1] + 1 if gl.enpassantPossible else 0
+    return POSITION_FORMAT.pack(occupancy,pieces,flags,enpassant,min(gl.halfmoveClock,0xFFFF),min(gl.fullmoveNumber,0xFFFF))
+
+''' FEN of a packed position (data is any bytes-like object, offset where the position starts in it)'''
+def positionToFen(data,offset=0):
+    occupancy, pieces, flags, enpassant, halfmove, fullmove = POSITION_FORMAT.unpack_from(data,offset)
+    whiteToMove = flags & 1
+    castling = flags >> 1
+    ranks = []
+    index = 0
+    for r in range(8):
+        rank = ''
+        empty = 0
+        for c in range(8):
+            if occupancy >> (r*8 + c) & 1:
+                code = pieces[index >> 1] >> (4 * (index & 1)) & 15
+                if code >= len(PIECE_CODES):
+                    raise ValueError('invalid piece code in packed position: {}'.format(code))
+                index += 1
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += ChessEngine.PIECES_FEN[PIECE_CODES[code]]
+            else:
+                empty += 1
+        ranks.append(rank + (str(empty) if empty else ''))
+    rights = ''.join(letter for bit, letter in ((1,'K'),(2,'Q'),(4,'k'),(8,'q')) if castling & bit) or '-'
+    if enpassant:
+        square = ChessEngine.Move.colsToFiles[enpassant - 1] + ('6' if whiteToMove else '3')
+    else:
+        square = '-'
+    return '{} {} {} {} {} {}'.format('/'.join(ranks),'w' if whiteToMove else 'b',rights,square,halfmove,fullmove)
+
+''' set up gl (or a new GameLogic) on a packed position'''
+def unpackPosition(data,gl=None,offset=0):
+    fen = positionToFen(data,offset)
+    if gl is None:
+        return ChessEngine.GameLogic(fen)
+    gl.load_fen(fen)
+    return gl
+
+''' MOVES '''
+''' move codes of a list of moves as bytes, 2 per move'''
+def packMoves(moves):
+    codes = array('H',[move.encode() for move in moves])
+    if not LITTLE_ENDIAN:
+        codes.byteswap()
+    return codes.tobytes()
+
+''' the move codes in a bytes-like object as a sequence of ints (a memoryview over the same memory when possible)'''
+def unpackMoves(data,offset=0,count=None):
+    view = memoryview(data)[offset:]
+    if count is not None:
+        view = view[:2 * count]
+    if LITTLE_ENDIAN:
+        return view.cast('B').cast('H')
+    codes = array('H',view.tobytes())
+    codes.byteswap()
+    return codes
+
+''' GAMES '''
+''' start position and moves of the game played on gl (gl is taken back to the start and played forward again)'''
+def packGame(gl):
+    moves = list(gl.moveLog)
+    for _ in moves:
+        gl.undo_move()
+    start = packPosition(gl)
+    for move in moves:
+        gl.make_move(move)
+    if len(moves) > 0xFFFF:
+        raise ValueError('a packed game holds at most 65535 moves')
+    return start + GAME_HEADER.pack(len(moves)) + packMoves(moves)
+
+''' size in bytes of the packed game at offset in data'''
+def gameSize(data,offset=0):
+    return POSITION_SIZE + GAME_HEADER.size + 2 * GAME_HEADER.unpack_from(data,offset + POSITION_SIZE)[0]
+
+''' set up gl (or a new GameLogic) on the start position of a packed game and play its moves'''
+def unpackGame(data,gl=None,offset=0):
+    gl = unpackPosition(data,gl,offset)
+    count = GAME_HEADER.unpack_from(data,offset + POSITION_SIZE)[0]
+    for code in unpackMoves(data,offset + POSITION_SIZE + GAME_HEADER.size,count):
+        gl.make_move(ChessEngine.Move.decode(code,gl.board))
+    return gl
+
+''' GAME FILES '''
+class GameWriter:
+    ''' writes packed games to a file, the index is written when the writer is closed '''
+    def __init__(self,path):
+        self.file = open(path,'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC,VERSION,0,0,0))
+        self.offsets = array('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    ''' add a game: a GameLogic (its moveLog from its start position) or an already packed game'''
+    def write(self,game):
+        data = packGame(game) if isinstance(game,ChessEngine.GameLogic) else game
+        self.offsets.append(self.file.tell())
+        self.file.write(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        indexOffset = self.file.tell()
+        offsets = array('Q',self.offsets)
+        if not LITTLE_ENDIAN:
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(FILE_HEADER.pack(MAGIC,VERSION,0,len(self.offsets),indexOffset))
+        self.file.close()
+
+class GameArchive:
+    '''
+    memory mapped game file, games are read by their number: len(archive), archive[i] (the packed game as bytes).
+    Games are copied out of the map (a few hundred bytes each), so what the archive returns stays valid after close.
+    '''
+    def __init__(self,path):
+        self.file = open(path,'rb')
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, _, self.count, indexOffset = FILE_HEADER.unpack_from(self.data,0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a packed game file: ' + path)
+        self.view = memoryview(self.data)
+        self.offsets = self.view[indexOffset:indexOffset + 8 * self.count].cast('Q') if LITTLE_ENDIAN else \
+            struct.unpack_from('<{}Q'.format(self.count),self.data,indexOffset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.offsets,memoryview):
+            self.offsets.release()
+        self.view.release()
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self,i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('game index out of range')
+        offset = self.offsets[i]
+        return self.data[offset:offset + gameSize(self.data,offset)]
+
+    ''' move codes of game i (a view over a copy of the game, not over the file)'''
+    def moves(self,i):
+        return unpackMoves(self[i],POSITION_SIZE + GAME_HEADER.size)
+
+    ''' FEN of the start position of game i'''
+    def startFen(self,i):
+        return positionToFen(self[i])
+
+    ''' set up gl (or a new GameLogic) on game i, with all its moves played'''
+    def load(self,i,gl=None):
+        return unpackGame(self[i],gl)
+
+'''
+round trip of a few games through a game file, closing the archive while the games and move codes read from it
+are still in use (they must not point into the closed memory map). Returns True when everything matches.
+'''
+def selfCheck():
+    gl = ChessEngine.GameLogic()
+    games = []
+    for notation in ('e2e4','e7e5','g1f3','b8c6','f1b5'):
+        gl.make_move(next(move for move in gl.getValidMoves() if move.getChessNotation() == notation))
+        games.append(packGame(gl))
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    try:
+        with GameWriter(path) as writer:
+            for game in games:
+                writer.write(game)
+        with GameArchive(path) as archive:
+            moves = archive.moves(len(games) - 1)
+            game = archive[0]
+        return list(moves) == [move.encode() for move in gl.moveLog] and game == games[0]
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    ok = selfCheck()
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,295 @@
+'''
+Bitboard backend for the chess engine. Every piece type of every color is kept as a 64-bit integer
+(bit r*8+c is the square board[r][c]), knight, king and pawn attacks come from precomputed tables and
+sliding attacks are found by scanning precomputed rays up to the first blocker.
+
+BitboardGameLogic is a drop-in GameLogic: it keeps the board list, make_move, undo_move and getValidMoves,
+it just keeps the bitboards in sync with the board and uses them to generate the moves.
+'''
+from ChessEngine import GameLogic, Move
+
+''' TABLES '''
+ALL_SQUARES = (1 << 64) - 1
+RANK_MASKS = [0xFF << (r*8) for r in range(8)] # by board row, row 0 is the 8th rank
+FILE_MASKS = [0x0101010101010101 << c for c in range(8)] # by board column, column 0 is the a-file
+
+def onBoard(r,c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+def buildLeaperTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = sq >> 3, sq & 7
+        bb = 0
+        for dr, dc in offsets:
+            if onBoard(r+dr,c+dc):
+                bb |= 1 << ((r+dr)*8 + c+dc)
+        table.append(bb)
+    return table
+
+KNIGHT_ATTACKS = buildLeaperTable(((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)))
+KING_ATTACKS = buildLeaperTable(((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)))
+# squares attacked by a pawn of that color standing on the square (white pawns move up the board, to row 0)
+PAWN_ATTACKS = {'w':buildLeaperTable(((-1,-1),(-1,1))),'b':buildLeaperTable(((1,-1),(1,1)))}
+
+# ray directions, the positive ones go towards higher square indexes so their first blocker is the lowest set bit
+ROOK_DIRECTIONS = ((-1,0),(0,-1),(1,0),(0,1))
+BISHOP_DIRECTIONS = ((-1,-1),(-1,1),(1,-1),(1,1))
+
+def buildRays(d):
+    rays = []
+    for sq in range(64):
+        r, c = (sq >> 3) + d[0], (sq & 7) + d[1]
+        bb = 0
+        while onBoard(r,c):
+            bb |= 1 << (r*8 + c)
+            r += d[0]
+            c += d[1]
+        rays.append(bb)
+    return rays
+
+# (rays, is the direction positive)
+ROOK_RAYS = [(buildRays(d), d[0]*8 + d[1] > 0) for d in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(buildRays(d), d[0]*8 + d[1] > 0) for d in BISHOP_DIRECTIONS]
+
+def buildLines():
+    # BETWEEN[a][b]: squares strictly between a and b, LINE[a][b]: the whole line through a and b (0 if not aligned)
+    between = [[0]*64 for _ in range(64)]
+    line = [[0]*64 for _ in range(64)]
+    for a in range(64):
+        for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full = buildRays(d)[a] | buildRays((-d[0],-d[1]))[a] | (1 << a)
+            r, c = (a >> 3) + d[0], (a & 7) + d[1]
+            path = 0
+            while onBoard(r,c):
+                b = r*8 + c
+                between[a][b] = path
+                line[a][b] = full
+                path |= 1 << b
+                r += d[0]
+                c += d[1]
+    return between, line
+
+BETWEEN, LINE = buildLines()
+
+''' BIT HELPERS '''
+def squares(bb):
+    # yields the index of every set bit, lowest first
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+def slidingAttacks(sq,occupied,rays):
+    attacks = 0
+    for ray, positive in rays:
+        attack = ray[sq]
+        blockers = attack & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            attack ^= ray[first]
+        attacks |= attack
+    return attacks
+
+def rookAttacks(sq,occupied):
+    return slidingAttacks(sq,occupied,ROOK_RAYS)
+
+def bishopAttacks(sq,occupied):
+    return slidingAttacks(sq,occupied,BISHOP_RAYS)
+
+
+class BitboardGameLogic(GameLogic):
+    ''' Rebuild every bitboard from the board list (after setting up a position by hand) '''
+    def syncBitboards(self):
+        self.bitboards = {color + piece: 0 for color in 'wb' for piece in 'pRNBQK'}
+        self.colorBitboards = {'w':0,'b':0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.bitboards[piece] |= 1 << (r*8 + c)
+                    self.colorBitboards[piece[0]] |= 1 << (r*8 + c)
+
+    def load_fen(self,fen): # also called by __init__
+        super().load_fen(fen)
+        self.syncBitboards()
+
+    ''' squares whose content can change when the move is made or undone '''
+    def changedSquares(self,move):
+        changed = [(move.startRow,move.startCol),(move.endRow,move.endCol)]
+        if move.isEnpassantMove:
+            changed.append((move.startRow,move.endCol))
+        if move.isCastleMove:
+            if move.endCol - move.startCol == 2: # king side rook
+                changed += [(move.endRow,move.endCol+1),(move.endRow,move.endCol-1)]
+            else: # queen side rook
+                changed += [(move.endRow,move.endCol-2),(move.endRow,move.endCol+1)]
+        return changed
+
+    def updateBitboards(self,changed,before):
+        for (r,c), old in zip(changed,before):
+            new = self.board[r][c]
+            if old != new:
+                bit = 1 << (r*8 + c)
+                if old != '--':
+                    self.bitboards[old] ^= bit
+                    self.colorBitboards[old[0]] ^= bit
+                if new != '--':
+                    self.bitboards[new] ^= bit
+                    self.colorBitboards[new[0]] ^= bit
+
+    def make_move(self,move):
+        changed = self.changedSquares(move)
+        before = [self.board[r][c] for r, c in changed]
+        super().make_move(move)
+        self.updateBitboards(changed,before)
+
+    def undo_move(self):
+        if len(self.moveLog) != 0:
+            changed = self.changedSquares(self.moveLog[-1])
+            before = [self.board[r][c] for r, c in changed]
+            super().undo_move()
+            self.updateBitboards(changed,before)
+
+    ''' bitboard of the pieces of attackerColor attacking square sq, for a given occupancy '''
+    def attackersOf(self,sq,attackerColor,occupied):
+        bb = self.bitboards
+        defenderColor = 'b' if attackerColor == 'w' else 'w'
+        queens = bb[attackerColor + 'Q']
+        return (KNIGHT_ATTACKS[sq] & bb[attackerColor + 'N']) | \
+               (PAWN_ATTACKS[defenderColor][sq] & bb[attackerColor + 'p']) | \
+               (KING_ATTACKS[sq] & bb[attackerColor + 'K']) | \
+               (rookAttacks(sq,occupied) & (bb[attackerColor + 'R'] | queens)) | \
+               (bishopAttacks(sq,occupied) & (bb[attackerColor + 'B'] | queens))
+
+    def squareUnderAttack(self,r,c,attackerColor=None):
+        if attackerColor is None:
+            attackerColor = 'b' if self.whiteToMove else 'w'
+        occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        return self.attackersOf(r*8 + c,attackerColor,occupied) != 0
+
+    def kingMoveIsSafe(self,move):
+        occupied = (self.colorBitboards['w'] | self.colorBitboards['b']) & ~(1 << (move.startRow*8 + move.startCol))
+        return self.attackersOf(move.endRow*8 + move.endCol,'b' if move.pieceMoved[0] == 'w' else 'w',occupied) == 0
+
+    ''' All moves considering checks, from the bitboards '''
+    def generateValidMoves(self):
+        moves = []
+        board = self.board
+        bb = self.bitboards
+        us, them = ('w','b') if self.whiteToMove else ('b','w')
+        own = self.colorBitboards[us]
+        enemy = self.colorBitboards[them]
+        occupied = own | enemy
+        kingBit = bb[us + 'K']
+        kingSq = kingBit.bit_length() - 1
+        kingRow, kingCol = kingSq >> 3, kingSq & 7
+
+        checkers = self.attackersOf(kingSq,them,occupied)
+        # pins: enemy sliders lined up with the king with exactly one of our pieces in between
+        pinned = 0
+        enemyQueens = bb[them + 'Q']
+        snipers = (rookAttacks(kingSq,0) & (bb[them + 'R'] | enemyQueens)) | \
+                  (bishopAttacks(kingSq,0) & (bb[them + 'B'] | enemyQueens))
+        for sniper in squares(snipers):
+            blockers = BETWEEN[kingSq][sniper] & occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & own:
+                pinned |= blockers
+
+        # king moves, the king is taken off the board so it doesn't shield the squares behind it
+        occupiedWithoutKing = occupied ^ kingBit
+        for to in squares(KING_ATTACKS[kingSq] & ~own):
+            if not self.attackersOf(to,them,occupiedWithoutKing):
+                moves.append(Move((kingRow,kingCol),(to >> 3,to & 7),board))
+
+        if checkers & (checkers - 1) == 0: # not in double check
+            if checkers: # capture the checking piece or block it
+                checkSq = checkers.bit_length() - 1
+                targets = checkers | BETWEEN[kingSq][checkSq]
+            else:
+                targets = ALL_SQUARES
+            # pieces
+            for piece, attacks in (('N',None),('B',BISHOP_RAYS),('R',ROOK_RAYS),('Q',None)):
+                for sq in squares(bb[us + piece]):
+                    if piece == 'N':
+                        if pinned >> sq & 1: # a pinned knight can't move
+                            continue
+                        destinations = KNIGHT_ATTACKS[sq]
+                    elif piece == 'Q':
+                        destinations = rookAttacks(sq,occupied) | bishopAttacks(sq,occupied)
+                    else:
+                        destinations = slidingAttacks(sq,occupied,attacks)
+                    destinations &= ~own & targets
+                    if pinned >> sq & 1:
+                        destinations &= LINE[kingSq][sq]
+                    r, c = sq >> 3, sq & 7
+                    for to in squares(destinations):
+                        moves.append(Move((r,c),(to >> 3,to & 7),board))
+            self.getPawnBitboardMoves(moves,us,them,occupied,enemy,targets,pinned,kingSq)
+            if not checkers:
+                self.getCastleBitboardMoves(moves,us,them,occupied,kingSq)
+
+        if self.underPromotions:
+            self.addUnderPromotions(moves)
+        ''' Checkmate and stalemate'''
+        if len(moves) == 0:
+            if checkers:self.checkMate = True
+            else:self.staleMate = True
+        return moves
+
+    def getPawnBitboardMoves(self,moves,us,them,occupied,enemy,targets,pinned,kingSq):
+        pawns = self.bitboards[us + 'p']
+        # unpinned pawns all at once, pinned ones one by one along their pin line
+        self.addPawnMoves(moves,pawns & ~pinned,us,occupied,enemy,targets)
+        for sq in squares(pawns & pinned):
+            self.addPawnMoves(moves,1 << sq,us,occupied,enemy,targets & LINE[kingSq][sq])
+        # en-passant, played out on the occupancy because it takes two pieces off the same rank
+        if self.enpassantPossible != ():
+            epSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1]
+            capturedSq = epSq + 8 if us == 'w' else epSq - 8
+            enemyPawns = self.bitboards[them + 'p']
+            for sq in squares(PAWN_ATTACKS[them][epSq] & pawns):
+                after = (occupied ^ (1 << sq) ^ (1 << capturedSq)) | (1 << epSq)
+                self.bitboards[them + 'p'] = enemyPawns ^ (1 << capturedSq)
+                exposed = self.attackersOf(kingSq,them,after)
+                self.bitboards[them + 'p'] = enemyPawns
+                if not exposed:
+                    moves.append(Move((sq >> 3,sq & 7),(epSq >> 3,epSq & 7),self.board,isEnpassantMove=True))
+
+    ''' pushes and captures of a set of pawns, only landing on the allowed squares '''
+    def addPawnMoves(self,moves,pawns,us,occupied,enemy,allowed):
+        if not pawns:
+            return
+        board = self.board
+        empty = ~occupied & ALL_SQUARES
+        if us == 'w': # white pawns move to lower square indexes
+            single = (pawns >> 8) & empty
+            double = ((single & RANK_MASKS[5]) >> 8) & empty
+            left = ((pawns & ~FILE_MASKS[0]) >> 9) & enemy
+            right = ((pawns & ~FILE_MASKS[7]) >> 7) & enemy
+            shifts = ((single,8),(double,16),(left,9),(right,7))
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & RANK_MASKS[2]) << 8) & empty
+            left = ((pawns & ~FILE_MASKS[0]) << 7) & enemy
+            right = ((pawns & ~FILE_MASKS[7]) << 9) & enemy
+            shifts = ((single,-8),(double,-16),(left,-7),(right,-9))
+        for destinations, shift in shifts:
+            for to in squares(destinations & allowed):
+                start = to + shift
+                moves.append(Move((start >> 3,start & 7),(to >> 3,to & 7),board))
+
+    def getCastleBitboardMoves(self,moves,us,them,occupied,kingSq):
+        rights = self.currentCastlingRights
+        kingSide = rights.wks if us == 'w' else rights.bks
+        queenSide = rights.wqs if us == 'w' else rights.bqs
+        r, c = kingSq >> 3, kingSq & 7
+        if kingSide and not occupied >> (kingSq+1) & 1 and not occupied >> (kingSq+2) & 1:
+            if not self.attackersOf(kingSq+1,them,occupied) and not self.attackersOf(kingSq+2,them,occupied):
+                moves.append(Move((r,c),(r,c+2),self.board,isCastleMove=True))
+        if queenSide and not occupied >> (kingSq-1) & 1 and not occupied >> (kingSq-2) & 1 and not occupied >> (kingSq-3) & 1:
+            if not self.attackersOf(kingSq-1,them,occupied) and not self.attackersOf(kingSq-2,them,occupied):
+                moves.append(Move((r,c),(r,c-2),self.board,isCastleMove=True))
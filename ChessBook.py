@@ -0,0 +1,151 @@
+'''
+Opening book: the moves played from known positions, built from PGN games.
+The book file is a header and entries of (position hash, 16 bit move code, weight) sorted by hash, 12 bytes each.
+It is memory mapped and looked up with a binary search, so it is never loaded in memory and every process
+using the same file shares the pages the OS caches.
+The weight of a move is 2 per game won and 1 per game drawn by the side that played it.
+
+usage: python ChessBook.py build games.pgn book.bin [--plies N] [--min-games N]
+       python ChessBook.py probe book.bin [FEN]
+'''
+import argparse
+import mmap
+import random
+import struct
+import sys
+import ChessEngine
+import ChessPGN
+
+MAGIC = b'CHSB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ') # magic, version, reserved, number of entries
+ENTRY = struct.Struct('<QHH') # position hash, move code, weight
+MAX_WEIGHT = 0xFFFF
+# points for the side to move of each result
+RESULT_POINTS = {'1-0':(2,0),'0-1':(0,2),'1/2-1/2':(1,1),'*':(1,1)} # (white, black)
+
+''' BUILDING '''
+'''
+{(hash, move code): [weight, games]} of the first plies of every game of the PGN file.
+Games with an invalid move are used up to that move.
+'''
+def collectMoves(pgn,plies=20):
+    counts = {}
+    gl = ChessEngine.GameLogic()
+    gl.underPromotions = True
+    for game in ChessPGN.readGames(pgn):
+        gl.load_fen(game.headers.get('FEN',ChessEngine.STARTING_FEN))
+        white, black = RESULT_POINTS.get(game.result,(1,1))
+        for san in game.sanMoves[:plies]:
+            try:
+                move = gl.parseSAN(san)
+            except ValueError:
+                break
+            entry = counts.setdefault((gl.hash,move.encode()),[0,0])
+            entry[0] += white if gl.whiteToMove else black
+            entry[1] += 1
+            gl.make_move(move)
+    return counts
+
+''' write the entries to a book file, sorted by hash and then by weight (best move first)'''
+def writeBook(path,counts,minGames=1):
+    entries = sorted(((h,code,min(weight,MAX_WEIGHT)) for (h,code), (weight,games) in counts.items()
+                      if games >= minGames and weight > 0),key=lambda entry: (entry[0],-entry[2],entry[1]))
+    with open(path,'wb') as f:
+        f.write(HEADER.pack(MAGIC,VERSION,0,len(entries)))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    return len(entries)
+
+def buildBook(pgn,path,plies=20,minGames=1):
+    return writeBook(path,collectMoves(pgn,plies),minGames)
+
+''' LOOKUP '''
+class OpeningBook:
+    def __init__(self,path):
+        self.file = open(path,'rb')
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, _, self.count = HEADER.unpack_from(self.data,0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not an opening book file: ' + path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def entry(self,i):
+        return ENTRY.unpack_from(self.data,HEADER.size + i * ENTRY.size)
+
+    ''' [(move code, weight)] stored for a position hash, binary search for the first entry of the hash'''
+    def lookup(self,h):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(self.data,HEADER.size + middle * ENTRY.size)[0] < h:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for i in range(low,self.count):
+            entryHash, code, weight = self.entry(i)
+            if entryHash != h:
+                break
+            found.append((code,weight))
+        return found
+
+    ''' [(Move, weight)] of the book moves of the position of gl that are valid in it (best first)'''
+    def moves(self,gl):
+        entries = self.lookup(gl.hash)
+        if not entries:
+            return []
+        checkMate, staleMate = gl.checkMate, gl.staleMate
+        validMoves = {move.encode(): move for move in gl.getValidMoves()}
+        gl.checkMate, gl.staleMate = checkMate, staleMate
+        return [(validMoves[code],weight) for code, weight in entries if code in validMoves]
+
+    ''' a book move for the position of gl (picked at random by weight, or the best one), None out of book'''
+    def choose(self,gl,rng=random,best=False):
+        moves = self.moves(gl)
+        if not moves:
+            return None
+        if best:
+            return moves[0][0]
+        pick = rng.uniform(0,sum(weight for _, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return moves[-1][0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or probe an opening book')
+    commands = parser.add_subparsers(dest='command',required=True)
+    build = commands.add_parser('build',help='build a book from a PGN file')
+    build.add_argument('pgn')
+    build.add_argument('book')
+    build.add_argument('--plies',type=int,default=20,help='moves of each game to put in the book')
+    build.add_argument('--min-games',type=int,default=1,help='leave out moves played in fewer games')
+    probe = commands.add_parser('probe',help='print the book moves of a position')
+    probe.add_argument('book')
+    probe.add_argument('fen',nargs='?',default=ChessEngine.STARTING_FEN)
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        print('{} entries'.format(buildBook(args.pgn,args.book,args.plies,args.min_games)))
+    else:
+        gl = ChessEngine.GameLogic(args.fen)
+        gl.underPromotions = True
+        with OpeningBook(args.book) as book:
+            for move, weight in book.moves(gl):
+                print(gl.getSAN(move),weight)
+    return 0
+
+if __name__ == '__main__':sys.exit(main())
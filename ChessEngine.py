@@ -3,42 +3,121 @@
 This class is responsible for storing all the information about the current state of a chess game. It will also 
 be responsible for determining the valid moves at the current state making and undoing moves. It will also keep a move log.
 '''
+import random
+import sys
+from collections import OrderedDict
+from ChessEvaluation import PIECE_SQUARE_SCORES
+
+''' ZOBRIST HASHING '''
+# one random 64-bit key per (piece, square), side to move, castling rights combination and enpassant file.
+# the seed is fixed so every process (and every saved file) gets the same hash for the same position
+_zobristRandom = random.Random(20220927)
+ZOBRIST_PIECES = {color + piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in 'wb' for piece in 'pRNBQK'} # square = row*8 + col
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(16)] # indexed by CastleRights.mask()
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)] # indexed by the enpassant column
+
+''' UNDO STACK '''
+# make_move saves the state a move can't give back on a flat preallocated list, one record of UNDO_FIELDS per ply:
+# castling rights mask, enpassant square, halfmove clock, hash and score from before the move (the captured piece is in the Move)
+UNDO_CASTLING, UNDO_ENPASSANT, UNDO_HALFMOVE, UNDO_HASH, UNDO_SCORE = range(5)
+UNDO_FIELDS = 5
+UNDO_STACK_PLIES = 512 # plies preallocated, the stack doubles if a game gets longer
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_PIECES = {'P':'wp','R':'wR','N':'wN','B':'wB','Q':'wQ','K':'wK',
+              'p':'bp','r':'bR','n':'bN','b':'bB','q':'bQ','k':'bK'}
+PIECES_FEN = {v: k for k,v in FEN_PIECES.items()}
+EMPTY_RUNS = {str(n):['--'] * n for n in range(1,9)}
+
+''' GENERATION MODES '''
+# what the piece generators of moveFunctions add: every move, only captures (with promotions and en-passant), only the others,
+# or captures and the quiet moves that give check (the checks are found from GameLogic.checkInfo, before making any Move)
+ALL_MOVES, CAPTURES, QUIETS, CAPTURES_AND_CHECKS = 0, 1, 2, 3
+
+''' GAME STATES '''
+CHECKMATE, STALEMATE = 'checkmate', 'stalemate'
+REPETITION, FIFTY_MOVES, INSUFFICIENT_MATERIAL = 'threefold repetition', 'fifty-move rule', 'insufficient material'
+DRAW_RULES = (REPETITION,FIFTY_MOVES,INSUFFICIENT_MATERIAL) # draws that don't depend on the valid moves
 
 class GameLogic:
-    def __init__(self):
+    def __init__(self,fen=None):
         '''
         Board is an 8*8 2d list, each element has 2 chars.
         - First element is color (b or w)
         - second element is the type of piece 
         - '--' is an empty space
+        The game starts at the initial position, or at the position of the FEN string if one is given.
         '''
-        self.board = [['bR','bN','bB','bQ','bK','bB','bN','bR'],
-                      ['bp','bp','bp','bp','bp','bp','bp','bp'],
-                      ['--','--','--','--','--','--','--','--'],
-                      ['--','--','--','--','--','--','--','--'],
-                      ['--','--','--','--','--','--','--','--'],
-                      ['--','--','--','--','--','--','--','--'],
-                      ['wp','wp','wp','wp','wp','wp','wp','wp'],
-                      ['wR','wN','wB','wQ','wK','wB','wN','wR']]
         self.moveFunctions = {'p':self.getPawnMoves,'R':self.getRookMoves,
                               'N':self.getKnightMoves,'B':self.getBishopMoves,
                               'Q':self.getQueenMoves,'K':self.getKingMoves}
-        self.whiteToMove = True
-        self.moveLog = []
-        self.whiteKingLocation = (7,4)
-        self.blackKingLocation = (0,4)
-        self.checkMate = False
-        self.staleMate = False
-        self.enpassantPossible = () # coordinates where passant capture is possible
-        
-        self.currentCastlingRights = CastleRights(True,True,True,True)
-        # how to copy castling rights from what were modifing in the updateCastleRights function and then
-        # store it in a log that keeps track of these changes as we're not creating another object each time; we're modifing it
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks,self.currentCastlingRights.bks,
-                                             self.currentCastlingRights.wqs,self.currentCastlingRights.bqs)]
+        self.pins = {} # (row,col) of a pinned piece -> direction of the pin, only filled while generating valid moves
+        self.checkInfo = None # squares the pieces give check from, only set while generating CAPTURES_AND_CHECKS
+        self.naiveMoveGeneration = False # True to validate moves by making them and looking for checks (slow, for cross-checking)
+        self.underPromotions = False # True to also generate promotions to rook, bishop and knight (the GUI always promotes to a queen)
+        self.moveCache = None # optional MoveCache of the valid moves of positions already seen
+        self.undoStack = [0] * (UNDO_FIELDS * UNDO_STACK_PLIES) # reused by every game set up on this object
+        # board, side to move, castling rights, enpassant square, move counters, hash and score (undone from undoStack)
+        self.load_fen(fen if fen is not None else STARTING_FEN)
+
+    ''' material + piece-square score computed from scratch'''
+    def computeScore(self):
+        score = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    score += PIECE_SQUARE_SCORES[piece][r*8 + c]
+        return score
+
+    ''' static evaluation from the point of view of the player to move'''
+    def evaluate(self):
+        return self.score if self.whiteToMove else -self.score
+
+    ''' zobrist key of the position computed from scratch'''
+    def computeHash(self):
+        h = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    h ^= ZOBRIST_PIECES[piece][r*8 + c]
+        if not self.whiteToMove:
+            h ^= ZOBRIST_BLACK_TO_MOVE
+        h ^= ZOBRIST_CASTLING[self.currentCastlingRights.mask()]
+        if self.enpassantPossible != ():
+            h ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return h
     
     ''' Takes a move as a parameter and executes it '''
     def make_move(self,move):
+        # save the state undo_move can't get back from the move
+        rightsMask = self.currentCastlingRights.mask()
+        stack = self.undoStack
+        i = len(self.moveLog) * UNDO_FIELDS
+        if i == len(stack):
+            stack.extend(stack) # values get overwritten, only the size matters
+        stack[i] = rightsMask
+        stack[i + UNDO_ENPASSANT] = self.enpassantPossible
+        stack[i + UNDO_HALFMOVE] = self.halfmoveClock
+        stack[i + UNDO_HASH] = self.hash
+        stack[i + UNDO_SCORE] = self.score
+        # hash out the castling rights and enpassant square before they change
+        h = self.hash ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[rightsMask]
+        if self.enpassantPossible != ():
+            h ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        start = move.startRow*8 + move.startCol
+        end = move.endRow*8 + move.endCol
+        h ^= ZOBRIST_PIECES[move.pieceMoved][start]
+        score = self.score - PIECE_SQUARE_SCORES[move.pieceMoved][start]
+        if move.isEnpassantMove:
+            h ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow*8 + move.endCol]
+            score -= PIECE_SQUARE_SCORES[move.pieceCaptured][move.startRow*8 + move.endCol]
+        elif move.pieceCaptured != '--':
+            h ^= ZOBRIST_PIECES[move.pieceCaptured][end]
+            score -= PIECE_SQUARE_SCORES[move.pieceCaptured][end]
         # move
         # this will not work for casling, pawn promotion and en-passent, they are done seperatly 
         self.board[move.startRow][move.startCol] = '--'
@@ -52,7 +131,7 @@ class GameLogic:
         
         # pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
             
         # enpassant move
         if move.isEnpassantMove:
@@ -75,8 +154,31 @@ class GameLogic:
                 
         # castling rights (if it's a king or castle move)
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks,self.currentCastlingRights.bks,
-                                                 self.currentCastlingRights.wqs,self.currentCastlingRights.bqs))
+
+        # hash in the piece on its new square (the promoted piece), the rook of a castle move and the new rights
+        h ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][end]
+        score += PIECE_SQUARE_SCORES[self.board[move.endRow][move.endCol]][end]
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + 'R'
+            if move.endCol - move.startCol == 2: # king side
+                h ^= ZOBRIST_PIECES[rook][end+1] ^ ZOBRIST_PIECES[rook][end-1]
+                score += PIECE_SQUARE_SCORES[rook][end-1] - PIECE_SQUARE_SCORES[rook][end+1]
+            else: # queen side
+                h ^= ZOBRIST_PIECES[rook][end-2] ^ ZOBRIST_PIECES[rook][end+1]
+                score += PIECE_SQUARE_SCORES[rook][end+1] - PIECE_SQUARE_SCORES[rook][end-2]
+        self.score = score
+
+        # move counters
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
+        h ^= ZOBRIST_CASTLING[self.currentCastlingRights.mask()]
+        if self.enpassantPossible != ():
+            h ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.hash = h
             
     ''' Undo the last move'''
     def undo_move(self):
@@ -94,17 +196,17 @@ class GameLogic:
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--' # leave landing square black
                 self.board[move.startRow][move.endCol] = move.pieceCaptured                
-                self.enpassantPossible = (move.endRow, move.endCol)
                 
-                # undo a 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-
-            # undo castling rights
-            self.castleRightsLog.pop() # get rid of the new castle rights from the move we're undoing
-            # set the current castle rights to the last one in the list
-            newRights = self.castleRightsLog[-1] 
-            self.currentCastlingRights = CastleRights(newRights.wks,newRights.bks,newRights.wqs,newRights.bqs)    
+            # castling rights, enpassant square, halfmove clock, hash and score from before the move
+            stack = self.undoStack
+            i = len(self.moveLog) * UNDO_FIELDS
+            self.currentCastlingRights.setMask(stack[i])
+            self.enpassantPossible = stack[i + UNDO_ENPASSANT]
+            self.halfmoveClock = stack[i + UNDO_HALFMOVE]
+            self.hash = stack[i + UNDO_HASH]
+            self.score = stack[i + UNDO_SCORE]
+            if move.pieceMoved[0] == 'b':
+                self.fullmoveNumber -= 1
             
             # undo castle move
             if move.isCastleMove:
@@ -117,14 +219,196 @@ class GameLogic:
 
     ''' All moves considering checks'''
     def getValidMoves(self):
-        # debuging 
-        # for log in self.castleRightsLog:
-        #     print(log.wks,log.bqs,log.wqs,log.bqs)
-
-        ### copy the current enpassant and castling rights so they don't change while making and undoing moves to get valid moves
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRights.wks,self.currentCastlingRights.bks,
-                                        self.currentCastlingRights.wqs,self.currentCastlingRights.bqs) 
+        if self.moveCache is None:
+            if self.naiveMoveGeneration:
+                return self.getValidMovesNaive()
+            return self.generateValidMoves()
+        key = (self.hash,self.underPromotions)
+        entry = self.moveCache.get(key)
+        if entry is not None:
+            moves, checkMate, staleMate = entry
+            if checkMate:self.checkMate = True
+            if staleMate:self.staleMate = True
+            return list(moves) # a copy, callers are free to reorder or trim their list
+        moves = self.getValidMovesNaive() if self.naiveMoveGeneration else self.generateValidMoves()
+        checkMate = len(moves) == 0 and self.inCheck()
+        self.moveCache.put(key,list(moves),checkMate,len(moves) == 0 and not checkMate)
+        return moves
+
+    ''' All moves considering checks, from the pins and checks on the king'''
+    def generateValidMoves(self):
+        # 1- find the pins and checks on our king once for this position
+        inCheck, self.pins, checks = self.checkPinsandChecks()
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        # 2- generate the moves, pinned pieces only move along their pin
+        if len(checks) > 1: # double check, only the king can move
+            moves = []
+            self.getKingMoves(kingRow,kingCol,moves)
+        else:
+            moves = self.getAllPossibleMoves()
+            if len(checks) == 1: # single check, capture the checking piece, block it or move the king
+                checkRow, checkCol = checks[0][0], checks[0][1]
+                validSquares = self.checkBlockSquares(checks[0],kingRow,kingCol)
+                moves = [move for move in moves if move.pieceMoved[1] == 'K' or (move.endRow,move.endCol) in validSquares
+                         or (move.isEnpassantMove and (move.startRow,move.endCol) == (checkRow,checkCol))]
+        self.pins = {}
+        if not inCheck:
+            self.getCastleMoves(kingRow,kingCol,moves)
+        # 3- the king can't step into an attacked square and en-passant can't uncover a check along the rank
+        moves = [move for move in moves if (move.pieceMoved[1] != 'K' or self.kingMoveIsSafe(move))
+                 and (not move.isEnpassantMove or not self.enpassantExposesKing(move))]
+        if self.underPromotions:
+            self.addUnderPromotions(moves)
+        ''' Checkmate and stalemate'''
+        if len(moves) == 0:
+            if inCheck:self.checkMate = True
+            else:self.staleMate = True
+        return moves
+
+    ''' squares a piece can move to against a check: the checking piece and, unless it's a knight, the squares up to it'''
+    def checkBlockSquares(self,check,kingRow,kingCol):
+        checkRow, checkCol, dr, dc = check
+        if self.board[checkRow][checkCol][1] == 'N': # a knight check can't be blocked
+            return {(checkRow,checkCol)}
+        validSquares = set()
+        for i in range(1,8):
+            square = (kingRow + dr * i, kingCol + dc * i)
+            validSquares.add(square)
+            if square == (checkRow,checkCol):
+                break
+        return validSquares
+
+    ''' STAGED GENERATION '''
+    '''
+    Yield the valid moves in stages: the hash move (if it is valid here), captures and promotions, then the quiet moves.
+    Every stage asks the piece generators of moveFunctions for its kind of moves one piece at a time, so a consumer
+    that stops early (a cutoff on the hash move or a capture) never pays for the moves it didn't look at.
+    captureKey / quietKey order a stage by decreasing key, that stage is then generated whole before its first move.
+    Moves can be made and undone between two yields, as long as the position is the same again when asking for the next.
+    '''
+    def generateMovesStaged(self,hashMove=None,captureKey=None,quietKey=None):
+        rules = self.moveRules()
+        found = 0
+        if hashMove is not None:
+            hashMove = self.validHashMove(hashMove,rules)
+            if hashMove is not None:
+                found += 1
+                yield hashMove
+        for mode, key in ((CAPTURES,captureKey),(QUIETS,quietKey)):
+            moves = self.generateStage(mode,rules)
+            if key is not None:
+                moves = sorted(moves,key=key,reverse=True)
+            for move in moves:
+                if move != hashMove:
+                    found += 1
+                    yield move
+        ''' Checkmate and stalemate'''
+        if found == 0:
+            if rules[0]:self.checkMate = True
+            else:self.staleMate = True
+
+    '''
+    (inCheck, pins, legal, king square, double check) of the side to move, for the staged generators:
+    legal(move) tells if a move from the piece generators is valid (check evasions, king safety, en-passant pins)
+    '''
+    def moveRules(self):
+        inCheck, pins, checks = self.checkPinsandChecks()
+        self.pins = {}
+        king = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        validSquares = None
+        checkSquare = None
+        if len(checks) == 1:
+            checkSquare = (checks[0][0],checks[0][1])
+            validSquares = self.checkBlockSquares(checks[0],king[0],king[1])
+        def legal(move):
+            if move.pieceMoved[1] == 'K':
+                return self.kingMoveIsSafe(move)
+            if validSquares is not None and (move.endRow,move.endCol) not in validSquares and \
+                    not (move.isEnpassantMove and (move.startRow,move.endCol) == checkSquare):
+                return False
+            return not move.isEnpassantMove or not self.enpassantExposesKing(move)
+        return inCheck, pins, legal, king, len(checks) > 1
+
+    ''' the valid moves of one stage (CAPTURES, QUIETS or CAPTURES_AND_CHECKS), yielded one piece at a time'''
+    def generateStage(self,mode,rules):
+        inCheck, pins, legal, king, doubleCheck = rules
+        color = 'w' if self.whiteToMove else 'b'
+        board = self.board
+        checkInfo = self.findCheckInfo() if mode == CAPTURES_AND_CHECKS else None
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c] # read again at every square, the consumer may have made and undone moves
+                if piece[0] != color or (doubleCheck and piece[1] != 'K'):
+                    continue
+                moves = []
+                self.pins = pins # the piece generators read the pins, other generations reset them in between
+                self.checkInfo = checkInfo
+                self.moveFunctions[piece[1]](r,c,moves,mode)
+                self.pins = {}
+                self.checkInfo = None
+                if mode != QUIETS and self.underPromotions:
+                    self.addUnderPromotions(moves)
+                for move in moves:
+                    if legal(move):
+                        yield move
+        if mode == QUIETS and not inCheck:
+            moves = []
+            self.getCastleMoves(king[0],king[1],moves)
+            for move in moves:
+                if legal(move):
+                    yield move
+
+    '''
+    Valid captures, promotions and en-passant captures, plus the quiet moves that give check when checks is True.
+    They come straight from the piece generators, the other quiet moves are never made (castling checks are left out).
+    An empty list doesn't mean there are no valid moves, see hasValidMoves.
+    '''
+    def getCaptureMoves(self,checks=False):
+        return list(self.generateStage(CAPTURES_AND_CHECKS if checks else CAPTURES,self.moveRules()))
+
+    ''' determine if the player to move has a valid move, stopping at the first one found'''
+    def hasValidMoves(self):
+        rules = self.moveRules()
+        for mode in (QUIETS,CAPTURES): # quiet moves are the most likely to exist
+            for _ in self.generateStage(mode,rules):
+                return True
+        return False
+
+    ''' the valid move of this position equal to hashMove (a move remembered from another search), or None'''
+    def validHashMove(self,hashMove,rules):
+        inCheck, pins, legal, king, doubleCheck = rules
+        r, c = hashMove.startRow, hashMove.startCol
+        piece = self.board[r][c]
+        if piece != hashMove.pieceMoved or piece[0] != ('w' if self.whiteToMove else 'b') or (doubleCheck and piece[1] != 'K'):
+            return None
+        moves = []
+        self.pins = pins
+        self.moveFunctions[piece[1]](r,c,moves,ALL_MOVES)
+        self.pins = {}
+        if hashMove.isCastleMove and not inCheck:
+            self.getCastleMoves(r,c,moves)
+        if self.underPromotions:
+            self.addUnderPromotions(moves)
+        for move in moves:
+            if move == hashMove:
+                return move if legal(move) else None
+        return None
+
+    ''' add a rook, bishop and knight promotion next to every (queen) promotion in the moves'''
+    def addUnderPromotions(self,moves):
+        for i in range(len(moves)):
+            move = moves[i]
+            if move.isPawnPromotion:
+                for piece in ('R','B','N'):
+                    moves.append(Move((move.startRow,move.startCol),(move.endRow,move.endCol),self.board,promotionChoice=piece))
+
+    ''' NAIVE METHOD '''
+    ''' All moves considering checks, by making each move and checking if our king is attacked'''
+    def getValidMovesNaive(self):
+        # (undo_move gives back the enpassant square and castling rights, no need to copy them)
         # 1- get all possible moves and castle moves
         moves = self.getAllPossibleMoves()
         if self.whiteToMove:
@@ -141,19 +425,23 @@ class GameLogic:
             if self.inCheck():moves.remove(moves[i])
             self.whiteToMove = not self.whiteToMove   
             self.undo_move()
+        if self.underPromotions:
+            self.addUnderPromotions(moves)
         ''' Checkmate and stalemate'''
         if len(moves) == 0:
             if self.inCheck():self.checkMate = True
             else:self.staleMate = True
-
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRights = tempCastleRights
         return moves
         
     
-    ''' ADVANCED ALGORITHM''' #! not completed/used
+    ''' ADVANCED ALGORITHM'''
+    ''' 
+    Look outwards from the king of the player to move and return (inCheck, pins, checks)
+    - pins: {(row,col) of the pinned piece: (direction of the pin)}
+    - checks: [(row,col) of the checking piece + direction from the king to it]
+    '''
     def checkPinsandChecks(self):
-        pins = []
+        pins = {}
         checks = []
         inCheck = False
         if self.whiteToMove:
@@ -166,24 +454,78 @@ class GameLogic:
             allyColor = 'b'
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        directions = ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)) 
+        # enemy pawns attack towards our side of the board
+        pawnDirection = -1 if self.whiteToMove else 1
+        # first 4 are orthogonal (rook), last 4 are diagonal (bishop)
+        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)) 
         for j in range(len(directions)):
             d = directions[j]
             possiblePin = () # reset possible pins
-            for i in range(1,7):
+            for i in range(1,8):
                 endRow = startRow + d[0] * i
                 endCol = startCol + d[1] * i
                 if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
                     endPiece = self.board[endRow][endCol]
                     if endPiece[0] == allyColor:
                         if possiblePin == (): # 1st allied piece could be pinned
-                            possiblePin = (endRow,endCol,d[0],d[1])
+                            possiblePin = (endRow,endCol)
                         else: # 2nd allied piece, so no pin or check possible in this direction
                             break
                     elif endPiece[0] == enemyColor:
-                        type = endPiece[1]    
+                        type = endPiece[1]
+                        # 1- orthogonally away from the king and the piece is a rook
+                        # 2- diagonally away from the king and the piece is a bishop
+                        # 3- 1 square away diagonally from the king and the piece is a pawn
+                        # 4- any direction and the piece is a queen
+                        # 5- any direction 1 square away and the piece is a king
+                        if (0 <= j <= 3 and type == 'R') or (4 <= j <= 7 and type == 'B') or \
+                                (i == 1 and type == 'p' and d[0] == pawnDirection and j >= 4) or \
+                                (type == 'Q') or (i == 1 and type == 'K'):
+                            if possiblePin == (): # no piece blocking, so it's a check
+                                inCheck = True
+                                checks.append((endRow,endCol,d[0],d[1]))
+                            else: # allied piece blocking, so it's a pin
+                                pins[possiblePin] = d
+                        break # enemy piece not applying a check or a pin
+                else:break # off board
+        # knight checks
+        knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+        for m in knightMoves:
+            endRow = startRow + m[0]
+            endCol = startCol + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == enemyColor and endPiece[1] == 'N':
+                    inCheck = True
+                    checks.append((endRow,endCol,m[0],m[1]))
+        return inCheck, pins, checks
+
+    ''' determine if the king can make the move without landing on an attacked square'''
+    def kingMoveIsSafe(self,move):
+        # take the king off its square so it doesn't block the attacks through the square it's leaving
+        self.board[move.startRow][move.startCol] = '--'
+        attacked = self.squareUnderAttack(move.endRow,move.endCol,'b' if move.pieceMoved[0] == 'w' else 'w')
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        return not attacked
+
+    ''' determine if an en-passant capture takes both pawns off the king's rank and uncovers a rook or queen'''
+    def enpassantExposesKing(self,move):
+        kingRow, kingCol = self.whiteKingLocation if move.pieceMoved[0] == 'w' else self.blackKingLocation
+        if kingRow != move.startRow:
+            return False
+        enemyColor = 'b' if move.pieceMoved[0] == 'w' else 'w'
+        for d in (-1,1):
+            c = kingCol + d
+            while 0 <= c < 8:
+                if c != move.startCol and c != move.endCol: # skip the two pawns leaving the rank
+                    piece = self.board[kingRow][c]
+                    if piece != '--':
+                        if piece[0] == enemyColor and (piece[1] == 'R' or piece[1] == 'Q'):
+                            return True
+                        break
+                c += d
+        return False
     
-    ''' NAIVE METHOD '''
     ''' determine if the current player is in check''' 
     def inCheck(self):
         if self.whiteToMove:return self.underAttack(self.whiteKingLocation[0],self.whiteKingLocation[1])
@@ -191,12 +533,50 @@ class GameLogic:
     
     ''' determine if the enemy can attack the square (r,c)'''
     def underAttack(self,r,c):
-        self.whiteToMove = not self.whiteToMove # switch to opponent's turn
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove # switch turns back to the original player
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c: # sqaure is under attack
+        return self.squareUnderAttack(r,c)
+
+    '''
+    determine if any piece of attackerColor ('w' or 'b', defaults to the player not to move) attacks the square (r,c).
+    Looks outwards from the square and stops at the first attacker found, no moves are generated.
+    '''
+    def squareUnderAttack(self,r,c,attackerColor=None):
+        if attackerColor is None:
+            attackerColor = 'b' if self.whiteToMove else 'w'
+        board = self.board
+        # knights
+        for d in ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)):
+            endRow = r + d[0]
+            endCol = c + d[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == attackerColor + 'N':
+                return True
+        # pawns (a white pawn attacks the square from the row below it, a black pawn from the row above)
+        pawnRow = r + 1 if attackerColor == 'w' else r - 1
+        if 0 <= pawnRow < 8:
+            if c - 1 >= 0 and board[pawnRow][c-1] == attackerColor + 'p':
+                return True
+            if c + 1 <= 7 and board[pawnRow][c+1] == attackerColor + 'p':
+                return True
+        # kings
+        for d in ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)):
+            endRow = r + d[0]
+            endCol = c + d[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == attackerColor + 'K':
                 return True
+        # sliders, the first 4 directions are for rooks and the last 4 for bishops (queens use both)
+        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
+        for j in range(8):
+            d = directions[j]
+            slider = 'R' if j < 4 else 'B'
+            endRow = r + d[0]
+            endCol = c + d[1]
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = board[endRow][endCol]
+                if endPiece != '--':
+                    if endPiece[0] == attackerColor and (endPiece[1] == slider or endPiece[1] == 'Q'):
+                        return True
+                    break # blocked
+                endRow += d[0]
+                endCol += d[1]
         return False
     
     ''' All moves without considering checks'''
@@ -210,78 +590,157 @@ class GameLogic:
                         self.moveFunctions[piece](r,c,moves) # calls the appropriate function based on the piece type
         return moves
         
+    ''' CHECKING MOVES '''
+    '''
+    (checkSquares, discoverers, king row, king col) for the side to move against the enemy king:
+    - checkSquares: piece letter -> empty squares that piece attacks the king from
+    - discoverers: (row,col) of our piece standing between the king and our rook, bishop or queen -> direction of the line
+    '''
+    def findCheckInfo(self):
+        if self.whiteToMove:
+            allyColor, (kingRow, kingCol) = 'w', self.blackKingLocation
+        else:
+            allyColor, (kingRow, kingCol) = 'b', self.whiteKingLocation
+        board = self.board
+        checkSquares = {'K':set()}
+        knightSquares = set()
+        for d in ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)):
+            endRow, endCol = kingRow + d[0], kingCol + d[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                knightSquares.add((endRow,endCol))
+        checkSquares['N'] = knightSquares
+        # a pawn attacks the king from the row behind it (below it for white pawns)
+        pawnRow = kingRow + 1 if allyColor == 'w' else kingRow - 1
+        checkSquares['p'] = {(pawnRow,col) for col in (kingCol - 1,kingCol + 1) if 0 <= pawnRow < 8 and 0 <= col < 8}
+        discoverers = {}
+        for j, d in enumerate(((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))):
+            slider = 'R' if j < 4 else 'B'
+            lineSquares = checkSquares.setdefault(slider,set())
+            blocker = None
+            endRow, endCol = kingRow + d[0], kingCol + d[1]
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = board[endRow][endCol]
+                if endPiece == '--':
+                    if blocker is None:
+                        lineSquares.add((endRow,endCol))
+                elif blocker is None and endPiece[0] == allyColor:
+                    blocker = (endRow,endCol) # our piece, it uncovers a check if one of our sliders is behind it
+                else:
+                    if blocker is not None and endPiece[0] == allyColor and (endPiece[1] == slider or endPiece[1] == 'Q'):
+                        discoverers[blocker] = d
+                    break
+                endRow += d[0]
+                endCol += d[1]
+        checkSquares['Q'] = checkSquares['R'] | checkSquares['B']
+        return checkSquares, discoverers, kingRow, kingCol
+
+    ''' determine if the quiet move of the piece on (r,c) to (endRow,endCol) gives check (directly or uncovered)'''
+    def quietMoveChecks(self,r,c,endRow,endCol):
+        checkSquares, discoverers, kingRow, kingCol = self.checkInfo
+        if (endRow,endCol) in checkSquares[self.board[r][c][1]]:
+            return True
+        d = discoverers.get((r,c))
+        # an uncovered check, unless the piece stays on the line between the king and the slider
+        return d is not None and (endRow - kingRow) * d[1] != (endCol - kingCol) * d[0]
+
     ''' Pieces Moves '''
-    def getPawnMoves(self,r,c,moves):
+    ''' a pinned piece can only move along the direction of its pin (towards or away from the king)'''
+    def pinAllows(self,pinDirection,d):
+        return pinDirection is None or d == pinDirection or d == (-pinDirection[0],-pinDirection[1])
+
+    def getPawnMoves(self,r,c,moves,mode=ALL_MOVES):
+        pinDirection = self.pins.get((r,c))
         if self.whiteToMove: # white pawn moves
-            if self.board[r-1][c] == '--': # 1 square move
-                moves.append(Move((r,c),(r-1,c),self.board))
-                if r == 6 and self.board[r-2][c] == '--': # 2 squares move
+            if self.board[r-1][c] == '--' and self.pinAllows(pinDirection,(-1,0)): # 1 square move
+                # promotions go with the captures
+                if mode == ALL_MOVES or (mode == QUIETS) != (r == 1) or (mode == CAPTURES_AND_CHECKS and self.quietMoveChecks(r,c,r-1,c)):
+                    moves.append(Move((r,c),(r-1,c),self.board))
+                if r == 6 and self.board[r-2][c] == '--' and mode != CAPTURES and \
+                        (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,r-2,c)): # 2 squares move
                     moves.append(Move((r,c),(r-2,c),self.board))
-            if c - 1 >= 0: # left capture
+            if mode == QUIETS:
+                return
+            if c - 1 >= 0 and self.pinAllows(pinDirection,(-1,-1)): # left capture
                 if self.board[r-1][c-1][0] == 'b': # enemy piece
                     moves.append(Move((r,c),(r-1,c-1),self.board))
                 elif (r-1,c-1) == self.enpassantPossible:
                     moves.append(Move((r,c),(r-1,c-1),self.board,isEnpassantMove=True))
-            if c + 1 <= 7: # right capture
+            if c + 1 <= 7 and self.pinAllows(pinDirection,(-1,1)): # right capture
                 if self.board[r-1][c+1][0] == 'b':
                     moves.append(Move((r,c),(r-1,c+1),self.board))
                 elif (r-1,c+1) == self.enpassantPossible:
                     moves.append(Move((r,c),(r-1,c+1),self.board,isEnpassantMove=True))            
                         
         else: # black pawn moves
-            if self.board[r+1][c] == '--': # 1 square move
-                moves.append(Move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == '--': # 2 squares move
+            if self.board[r+1][c] == '--' and self.pinAllows(pinDirection,(1,0)): # 1 square move
+                if mode == ALL_MOVES or (mode == QUIETS) != (r == 6) or (mode == CAPTURES_AND_CHECKS and self.quietMoveChecks(r,c,r+1,c)):
+                    moves.append(Move((r,c),(r+1,c),self.board))
+                if r == 1 and self.board[r+2][c] == '--' and mode != CAPTURES and \
+                        (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,r+2,c)): # 2 squares move
                     moves.append(Move((r,c),(r+2,c),self.board))
-            if c - 1 >= 0: # left capture
+            if mode == QUIETS:
+                return
+            if c - 1 >= 0 and self.pinAllows(pinDirection,(1,-1)): # left capture
                 if self.board[r+1][c-1][0] == 'w': # enemy piece
                     moves.append(Move((r,c),(r+1,c-1),self.board))
                 elif (r+1,c-1) == self.enpassantPossible:
                     moves.append(Move((r,c),(r+1,c-1),self.board,isEnpassantMove=True))                    
-            if c + 1 <= 7: # right capture
+            if c + 1 <= 7 and self.pinAllows(pinDirection,(1,1)): # right capture
                 if self.board[r+1][c+1][0] == 'w':
                     moves.append(Move((r,c),(r+1,c+1),self.board))   
                 elif (r+1,c+1) == self.enpassantPossible:
                     moves.append(Move((r,c),(r+1,c+1),self.board,isEnpassantMove=True))                             
                 
                     
-    def getRookMoves(self,r,c,moves):
+    def getRookMoves(self,r,c,moves,mode=ALL_MOVES):
         directions = ((-1,0),(0,-1),(1,0),(0,1)) # up, left, down, right
         enemyColor = 'b' if self.whiteToMove else 'w'
+        pinDirection = self.pins.get((r,c))
         for d in directions:
+            if not self.pinAllows(pinDirection,d):
+                continue
             for i in range(1,8):
                 endRow = r + d[0] * i
                 endCol = c + d[1] * i # it'll only move in one direction because of the 0's in the directions tupple
                 if 0 <= endRow < 8 and 0 <= endCol < 8: # if it's on board
                     endPiece = self.board[endRow][endCol]
                     if endPiece == '--': #empty space valid
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
+                        if mode != CAPTURES and (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,endRow,endCol)):
+                            moves.append(Move((r,c),(endRow,endCol),self.board))
                     elif endPiece[0] == enemyColor: # enemy piece valid
-                        moves.append(Move((r,c),(endRow,endCol),self.board))        
+                        if mode != QUIETS:
+                            moves.append(Move((r,c),(endRow,endCol),self.board))
                         break
                     else: # friendly piece invalid
                         break                
                 else:break # off board
     
-    def getBishopMoves(self,r,c,moves):
+    def getBishopMoves(self,r,c,moves,mode=ALL_MOVES):
         directions = ((-1,-1),(-1,1),(1,-1),(1,1)) # diaganols
         enemyColor = 'b' if self.whiteToMove else 'w'
+        pinDirection = self.pins.get((r,c))
         for d in directions:
+            if not self.pinAllows(pinDirection,d):
+                continue
             for i in range(1,8):
                 endRow = r + d[0] * i
                 endCol = c + d[1] * i 
                 if 0 <= endRow < 8 and 0 <= endCol < 8: # if it's on board
                     endPiece = self.board[endRow][endCol]
                     if endPiece == '--': #empty space valid
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
+                        if mode != CAPTURES and (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,endRow,endCol)):
+                            moves.append(Move((r,c),(endRow,endCol),self.board))
                     elif endPiece[0] == enemyColor: # enemy piece valid
-                        moves.append(Move((r,c),(endRow,endCol),self.board))        
+                        if mode != QUIETS:
+                            moves.append(Move((r,c),(endRow,endCol),self.board))
                         break
                     else: # friendly piece invalid
                         break                
                 else:break # off board            
     
-    def getKnightMoves(self,r,c,moves):
+    def getKnightMoves(self,r,c,moves,mode=ALL_MOVES):
+        if (r,c) in self.pins: # a pinned knight can never move along the pin
+            return
         directions = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)) # all L movements
         enemyColor = 'b' if self.whiteToMove else 'w'
         for d in directions:
@@ -289,14 +748,15 @@ class GameLogic:
             endCol = c + d[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor or endPiece == '--':
+                if (endPiece[0] == enemyColor and mode != QUIETS) or (endPiece == '--' and mode != CAPTURES and
+                                                                      (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,endRow,endCol))):
                     moves.append(Move((r,c),(endRow,endCol),self.board))
 
-    def getQueenMoves(self,r,c,moves): # Rook and bishop combined
-        self.getBishopMoves(r,c,moves)
-        self.getRookMoves(r,c,moves)
+    def getQueenMoves(self,r,c,moves,mode=ALL_MOVES): # Rook and bishop combined
+        self.getBishopMoves(r,c,moves,mode)
+        self.getRookMoves(r,c,moves,mode)
     
-    def getKingMoves(self,r,c,moves):
+    def getKingMoves(self,r,c,moves,mode=ALL_MOVES):
         kingMoves = ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1))  
         enemyColor = 'b' if self.whiteToMove else 'w'
         allyColor = 'w' if enemyColor == 'b' else 'b'
@@ -305,7 +765,8 @@ class GameLogic:
             endCol = c + kingMoves[i][1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor or endPiece == '--':
+                if (endPiece[0] == enemyColor and mode != QUIETS) or (endPiece == '--' and mode != CAPTURES and
+                                                                      (mode != CAPTURES_AND_CHECKS or self.quietMoveChecks(r,c,endRow,endCol))):
                     moves.append(Move((r,c),(endRow,endCol),self.board))   
                      
     ''' Castling related'''
@@ -330,6 +791,19 @@ class GameLogic:
                     self.currentCastlingRights.bqs = False
                 elif move.startCol == 7: # right rook
                     self.currentCastlingRights.bks = False    
+        # if a rook is captured on its starting square that side can't castle anymore
+        if move.pieceCaptured == 'wR':
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRights.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.wks = False
+        elif move.pieceCaptured == 'bR':
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRights.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRights.bks = False
                     
                     
     # generale all valid castle moves for the king at (r,c) and add them to the list of moves
@@ -354,9 +828,320 @@ class GameLogic:
     
     def getQueenSideCastleMoves(self,r,c,moves): # check 3 squares
         # we don't need to check if it's on board because we'll only check it if they still have castling rights
-        if self.board[r][c-1] == '--' and self.board[r][c-2] and self.board[r][c-3] == '--':
+        if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
             if not self.underAttack(r,c-1) and not self.underAttack(r,c-2):
                 moves.append(Move((r,c),(r,c-2),self.board,isCastleMove=True))
+
+    ''' DRAWS '''
+    '''
+    True if the position occurred count times, this one included. The hashes of the earlier positions are in
+    undoStack, only the ones with the same side to move since the last capture or pawn move can be the same.
+    '''
+    def isRepetition(self,count=3):
+        stack = self.undoStack
+        h = self.hash
+        ply = len(self.moveLog)
+        first = max(ply - self.halfmoveClock,0) # the position right after the last irreversible move
+        seen = 1
+        for i in range((ply - 2) * UNDO_FIELDS + UNDO_HASH,first * UNDO_FIELDS - 1,-2 * UNDO_FIELDS):
+            if stack[i] == h:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    ''' 50 moves by each side without a capture or a pawn move'''
+    def isFiftyMoveRule(self):
+        return self.halfmoveClock >= 100
+
+    ''' no side can mate: kings alone, one knight or bishop, or bishops all on squares of one color'''
+    def isInsufficientMaterial(self):
+        minors = []
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece == '--' or piece[1] == 'K':
+                    continue
+                if piece[1] not in 'BN':
+                    return False
+                minors.append((piece[1],(r + c) & 1))
+        if len(minors) <= 1:
+            return True
+        return all(kind == 'B' and color == minors[0][1] for kind, color in minors)
+
+    '''
+    state of the game at this position: CHECKMATE, STALEMATE, one of the DRAW_RULES or None while the game goes on.
+    validMoves are the valid moves of the position if the caller has them already.
+    '''
+    def getGameState(self,validMoves=None):
+        if validMoves is None:
+            validMoves = self.getValidMoves()
+        if len(validMoves) == 0:
+            return CHECKMATE if self.inCheck() else STALEMATE # a mate on the 100th half move still wins
+        if self.isInsufficientMaterial():
+            return INSUFFICIENT_MATERIAL
+        if self.isFiftyMoveRule():
+            return FIFTY_MOVES
+        if self.isRepetition(3):
+            return REPETITION
+        return None
+
+    ''' Position setup '''
+    '''
+    set up the position of a FEN string: placement, side to move, castling rights, enpassant square and
+    (optionally) the halfmove clock and fullmove number. The hash and score are computed in the same pass.
+    '''
+    def load_fen(self,fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError('FEN needs at least 4 fields: ' + fen)
+        if fields[1] not in ('w','b'):
+            raise ValueError('FEN side to move must be w or b: ' + fields[1])
+        board = []
+        h = 0
+        score = 0
+        # a reused GameLogic mustn't keep the kings of its last position
+        self.whiteKingLocation = None
+        self.blackKingLocation = None
+        kings = 0
+        for rank in fields[0].split('/'):
+            r = len(board)
+            row = []
+            for char in rank:
+                piece = FEN_PIECES.get(char)
+                if piece is not None:
+                    sq = r*8 + len(row)
+                    h ^= ZOBRIST_PIECES[piece][sq]
+                    score += PIECE_SQUARE_SCORES[piece][sq]
+                    if piece[1] == 'K':
+                        kings += 1
+                        if piece == 'wK':self.whiteKingLocation = (r,len(row))
+                        else:self.blackKingLocation = (r,len(row))
+                    row.append(piece)
+                elif char in EMPTY_RUNS:
+                    row += EMPTY_RUNS[char]
+                else:
+                    raise ValueError('invalid piece in FEN: ' + char)
+            if len(row) != 8:
+                raise ValueError('FEN rank does not have 8 squares: ' + rank)
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError('FEN does not have 8 ranks: ' + fen)
+        if kings != 2 or self.whiteKingLocation is None or self.blackKingLocation is None:
+            raise ValueError('FEN needs exactly one king per side: ' + fen)
+        self.board = board
+        self.whiteToMove = fields[1] == 'w'
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        castling = fields[2]
+        # a right is only kept when the king and that rook are still on their home squares
+        whiteKing, blackKing = board[7][4] == 'wK', board[0][4] == 'bK'
+        self.currentCastlingRights = CastleRights('K' in castling and whiteKing and board[7][7] == 'wR',
+                                                  'k' in castling and blackKing and board[0][7] == 'bR',
+                                                  'Q' in castling and whiteKing and board[7][0] == 'wR',
+                                                  'q' in castling and blackKing and board[0][0] == 'bR')
+        if fields[3] == '-':
+            self.enpassantPossible = ()
+        else:
+            # the square the pawn that just moved two squares skipped, rank 6 when white is to move and 3 for black
+            square = fields[3]
+            if len(square) != 2 or square[0] not in Move.filestoCols or square[1] != ('6' if self.whiteToMove else '3'):
+                raise ValueError('invalid en passant square in FEN: ' + square)
+            self.enpassantPossible = (Move.ranksToRows[square[1]],Move.filestoCols[square[0]])
+            h ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        # moves since the last capture or pawn move, and number of the current full move (starts at 1, +1 after black moves)
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        if not self.whiteToMove:
+            h ^= ZOBRIST_BLACK_TO_MOVE
+        self.hash = h ^ ZOBRIST_CASTLING[self.currentCastlingRights.mask()]
+        self.score = score
+
+    ''' FEN string of the current position'''
+    def to_fen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += PIECES_FEN[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.currentCastlingRights
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        if self.enpassantPossible == ():
+            enpassant = '-'
+        else:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowToRanks[self.enpassantPossible[0]]
+        return '{} {} {} {} {} {}'.format('/'.join(ranks),'w' if self.whiteToMove else 'b',castling or '-',
+                                          enpassant,self.halfmoveClock,self.fullmoveNumber)
+
+    ''' new game at the position of a FEN string'''
+    @classmethod
+    def from_fen(cls,fen):
+        return cls(fen)
+
+    ''' Standard algebraic notation '''
+    ''' SAN of a valid move in the current position (e.g. Nbd7, exd5, e8=Q+, O-O#)'''
+    def getSAN(self,move,validMoves=None):
+        if move.isCastleMove:
+            san = 'O-O' if move.endCol > move.startCol else 'O-O-O'
+        else:
+            piece = move.pieceMoved[1]
+            destination = move.getRankFile(move.endRow,move.endCol)
+            isCapture = move.pieceCaptured != '--'
+            if piece == 'p':
+                san = (move.colsToFiles[move.startCol] + 'x' if isCapture else '') + destination
+                if move.isPawnPromotion:
+                    san += '=' + move.promotionChoice
+            else:
+                if validMoves is None:
+                    validMoves = self.getValidMoves()
+                # other pieces of the same type that can reach the same square
+                others = [other for other in validMoves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow
+                          and other.endCol == move.endCol and (other.startRow,other.startCol) != (move.startRow,move.startCol)]
+                disambiguation = ''
+                if others:
+                    if all(other.startCol != move.startCol for other in others):
+                        disambiguation = move.colsToFiles[move.startCol]
+                    elif all(other.startRow != move.startRow for other in others):
+                        disambiguation = move.rowToRanks[move.startRow]
+                    else:
+                        disambiguation = move.getRankFile(move.startRow,move.startCol)
+                san = piece + disambiguation + ('x' if isCapture else '') + destination
+        # check or checkmate
+        checkMate, staleMate = self.checkMate, self.staleMate
+        self.make_move(move)
+        if self.inCheck():
+            san += '#' if len(self.getValidMoves()) == 0 else '+'
+        self.undo_move()
+        self.checkMate, self.staleMate = checkMate, staleMate
+        return san
+
+    ''' the valid move written in SAN, raises ValueError if no valid move (or more than one) matches it'''
+    def parseSAN(self,san,validMoves=None):
+        if validMoves is None:
+            validMoves = self.getValidMoves()
+        text = san.rstrip('+#!?')
+        if text in ('O-O','0-0','O-O-O','0-0-0'):
+            kingSide = len(text) == 3
+            for move in validMoves:
+                if move.isCastleMove and (move.endCol > move.startCol) == kingSide:
+                    return move
+            raise ValueError('castling is not valid here: ' + san)
+        promotion = 'Q'
+        if '=' in text:
+            text, promotion = text.split('=')
+        elif text and text[-1] in 'QRBN' and text[0] not in 'KQRBN': # promotion written without '=' (e8Q)
+            text, promotion = text[:-1], text[-1]
+        if len(text) < 2 or text[-2] not in Move.filestoCols or text[-1] not in Move.ranksToRows or promotion not in Move.PROMOTION_PIECES:
+            raise ValueError('not a SAN move: ' + san)
+        piece = text[0] if text[0] in 'KQRBN' else 'p'
+        endRow = Move.ranksToRows[text[-1]]
+        endCol = Move.filestoCols[text[-2]]
+        # what's left is the disambiguation (a file, a rank or both)
+        fromFile = fromRank = None
+        for char in text[(1 if piece != 'p' else 0):-2].replace('x',''):
+            if char in Move.filestoCols:fromFile = Move.filestoCols[char]
+            elif char in Move.ranksToRows:fromRank = Move.ranksToRows[char]
+            else:raise ValueError('not a SAN move: ' + san)
+        matches = [move for move in validMoves if move.pieceMoved[1] == piece and move.endRow == endRow and move.endCol == endCol
+                   and not move.isCastleMove and (fromFile is None or move.startCol == fromFile)
+                   and (fromRank is None or move.startRow == fromRank)
+                   and (not move.isPawnPromotion or move.promotionChoice == promotion)]
+        if len(matches) != 1:
+            raise ValueError(('no' if not matches else 'ambiguous') + ' valid move for ' + san)
+        return matches[0]
+
+    ''' Perft '''
+    ''' count the leaf nodes of the tree of valid moves, depth plies deep (to test and time the move generation)'''
+    def perft(self,depth):
+        if depth == 0:
+            return 1
+        # getValidMoves flags mates it finds in the tree, keep the flags of the current position
+        checkMate, staleMate = self.checkMate, self.staleMate
+        nodes = self.perftNodes(depth)
+        self.checkMate, self.staleMate = checkMate, staleMate
+        return nodes
+
+    def perftNodes(self,depth):
+        moves = self.getValidMoves()
+        if depth == 1: # no need to make the moves of the last ply, just count them
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perftNodes(depth-1)
+            self.undo_move()
+        return nodes
+
+    ''' perft split by the first move: {move notation: leaf nodes under it}'''
+    def divide(self,depth):
+        result = {}
+        for move in self.getValidMoves():
+            self.make_move(move)
+            result[move.getChessNotation()] = self.perft(depth-1)
+            self.undo_move()
+        return result
+
+         
+class MoveCache:
+    '''
+    Bounded least recently used cache of the valid moves of a position, keyed by its zobrist hash.
+    Stores (moves, checkMate, staleMate) and counts hits, misses and evictions.
+    Bounded by a number of entries and optionally by an approximate size in megabytes.
+    '''
+    def __init__(self,maxEntries=100000,maxMegabytes=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxMegabytes * 1024 * 1024 if maxMegabytes is not None else None
+        self.entries = OrderedDict()
+        self.size = 0 # approximate bytes used by the entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ''' approximate memory of an entry: the list, its moves and the cache bookkeeping'''
+    @staticmethod
+    def entrySize(moves):
+        return 200 + sys.getsizeof(moves) + len(moves) * MOVE_SIZE
+
+    def get(self,key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self,key,moves,checkMate,staleMate):
+        if key in self.entries:
+            self.size -= self.entrySize(self.entries[key][0])
+        self.entries[key] = (moves,checkMate,staleMate)
+        self.entries.move_to_end(key)
+        self.size += self.entrySize(moves)
+        # evict the least recently used entries
+        while len(self.entries) > self.maxEntries or (self.maxBytes is not None and self.size > self.maxBytes and len(self.entries) > 1):
+            _, (oldMoves, _, _) = self.entries.popitem(last=False)
+            self.size -= self.entrySize(oldMoves)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'entries':len(self.entries),'megabytes':self.size / (1024 * 1024),
+                'hits':self.hits,'misses':self.misses,'evictions':self.evictions}
+
          
 class CastleRights:
     def __init__(self,wks,bks,wqs,bqs): #  (w or b) + (king or queen) + side
@@ -364,6 +1149,17 @@ class CastleRights:
         self.bks = bks
         self.wqs = wqs
         self.bqs = bqs
+
+    ''' the 4 rights as bits (wks=1, wqs=2, bks=4, bqs=8)'''
+    def mask(self):
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+    ''' set the 4 rights from a mask (in place, undo_move doesn't allocate new rights)'''
+    def setMask(self,mask):
+        self.wks = bool(mask & 1)
+        self.wqs = bool(mask & 2)
+        self.bks = bool(mask & 4)
+        self.bqs = bool(mask & 8)
         
    
 class Move:
@@ -377,35 +1173,102 @@ class Move:
     filestoCols = {'a':0,'b':1,'c':2,'d':3,
                    'e':4,'f':5,'g':6,'h':7}
     colsToFiles = {v: k for k,v in filestoCols.items()}
+
+    # 16 bit move code: bits 0-5 start square, bits 6-11 end square (square = row*8 + col), bits 12-15 flags
+    ENPASSANT_FLAG = 1
+    CASTLE_FLAG = 2
+    # bits 14-15 are the promotion piece (0 for a queen, so a queen promotion equals a move built by the GUI)
+    PROMOTION_PIECES = 'QRBN'
+
+    # no instance __dict__, moves are created by the thousand for every getValidMoves call
+    __slots__ = ('startRow','startCol','endRow','endCol','pieceMoved','pieceCaptured',
+                 'isPawnPromotion','promotionChoice','isEnpassantMove','isCastleMove','moveID')
     
-    def __init__(self,startSq,endSq,board,isEnpassantMove=False,isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    def __init__(self,startSq,endSq,board,isEnpassantMove=False,isCastleMove=False,promotionChoice='Q'):
+        self.startRow = startRow = startSq[0]
+        self.startCol = startCol = startSq[1]
+        self.endRow = endRow = endSq[0]
+        self.endCol = endCol = endSq[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        self.pieceCaptured = board[endRow][endCol]
     
         # pawn promotion
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.isPawnPromotion = (pieceMoved == 'wp' and endRow == 0) or (pieceMoved == 'bp' and endRow == 7)
+        self.promotionChoice = promotionChoice
         # Enpassant
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+        if isEnpassantMove:
+            self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
         # self.isEnpassantMove =  (self.pieceMoved[1] == 'p' and (self.endRow,self.endCol) == enpassantPossible)
         
         # castle move
         self.isCastleMove = isCastleMove
         
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # start and end squares packed in 12 bits
+        self.moveID = (startRow << 3 | startCol) | (endRow << 3 | endCol) << 6
+        if promotionChoice != 'Q':
+            self.moveID |= Move.PROMOTION_PIECES.index(promotionChoice) << 14
     
     ''' Overriding the equals method ''' # TODO: come back to it to understand it
     def __eq__(self,other):
         if isinstance(other,Move):
             return self.moveID == other.moveID
         return False
+
+    ''' equal moves have the same moveID so they hash the same (moves can be used in sets and as dict keys)'''
+    def __hash__(self):
+        return self.moveID
+
+    ''' packed 16 bit code of the move (see decode to get the Move back)'''
+    def encode(self):
+        flags = 0
+        if self.isEnpassantMove:flags |= Move.ENPASSANT_FLAG
+        if self.isCastleMove:flags |= Move.CASTLE_FLAG
+        return self.moveID | flags << 12
+
+    ''' build the full Move from its 16 bit code and the board it is played on'''
+    @staticmethod
+    def decode(code,board):
+        start = code & 63
+        end = code >> 6 & 63
+        flags = code >> 12
+        return Move((start >> 3,start & 7),(end >> 3,end & 7),board,
+                    isEnpassantMove=bool(flags & Move.ENPASSANT_FLAG),isCastleMove=bool(flags & Move.CASTLE_FLAG),
+                    promotionChoice=Move.PROMOTION_PIECES[flags >> 2])
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        notation = self.getRankFile(self.startRow,self.startCol) + self.getRankFile(self.endRow,self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
     def getRankFile(self,r,c):
-        return self.colsToFiles[c]+self.rowToRanks[r]
\ No newline at end of file
+        return self.colsToFiles[c]+self.rowToRanks[r]
+
+MOVE_SIZE = sys.getsizeof(Move((6,4),(4,4),GameLogic().board)) # bytes of one Move object, for MoveCache sizes
+
+'''
+FEN fields that don't match the board: castling rights without the king and rook on their home squares are
+dropped, an en passant square on the wrong rank is rejected. Returns True when everything matches.
+'''
+def selfCheck():
+    gl = GameLogic('4k3/8/8/8/8/8/8/7K w K - 0 1') # king off its home square
+    ok = gl.to_fen().split()[2] == '-' and len(gl.getValidMoves()) == 3
+    gl.load_fen('r3k3/8/8/8/8/8/8/4K3 w KQkq - 0 1') # kings at home but only the a8 rook
+    ok = ok and gl.to_fen().split()[2] == 'q' and not any(move.isCastleMove for move in gl.getValidMoves())
+    gl.load_fen('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    ok = ok and gl.to_fen().split()[2] == 'KQkq' and sum(move.isCastleMove for move in gl.getValidMoves()) == 2
+    gl.load_fen('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+    ok = ok and any(move.isEnpassantMove for move in gl.getValidMoves())
+    for fen in ('4k3/8/8/3pP3/8/8/8/4K3 w - d3 0 1','4k3/8/8/8/3Pp3/8/8/4K3 b - d6 0 1','4k3/8/8/8/8/8/8/4K3 w - e4 0 1',
+                '4k3/8/8/8/8/8/8/4K3 w - z6 0 1'):
+        try:
+            gl.load_fen(fen)
+            ok = False
+        except ValueError:
+            pass
+    return ok
+
+if __name__ == '__main__':
+    ok = selfCheck()
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
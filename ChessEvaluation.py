@@ -0,0 +1,69 @@
+'''
+Static evaluation tables: material values and piece-square tables (from the "simplified evaluation function").
+GameLogic keeps the sum of PIECE_SQUARE_SCORES over the board as a running total (gl.score) that make_move
+and undo_move update, so evaluating a position doesn't need to look at the 64 squares.
+'''
+
+PIECE_VALUES = {'p':100,'N':320,'B':330,'R':500,'Q':900,'K':0}
+
+# bonus of a white piece on each square, row 0 is the 8th rank like the board (black uses the mirrored row)
+PIECE_SQUARE_TABLES = {
+    'p':[[  0,  0,  0,  0,  0,  0,  0,  0],
+         [ 50, 50, 50, 50, 50, 50, 50, 50],
+         [ 10, 10, 20, 30, 30, 20, 10, 10],
+         [  5,  5, 10, 25, 25, 10,  5,  5],
+         [  0,  0,  0, 20, 20,  0,  0,  0],
+         [  5, -5,-10,  0,  0,-10, -5,  5],
+         [  5, 10, 10,-20,-20, 10, 10,  5],
+         [  0,  0,  0,  0,  0,  0,  0,  0]],
+    'N':[[-50,-40,-30,-30,-30,-30,-40,-50],
+         [-40,-20,  0,  0,  0,  0,-20,-40],
+         [-30,  0, 10, 15, 15, 10,  0,-30],
+         [-30,  5, 15, 20, 20, 15,  5,-30],
+         [-30,  0, 15, 20, 20, 15,  0,-30],
+         [-30,  5, 10, 15, 15, 10,  5,-30],
+         [-40,-20,  0,  5,  5,  0,-20,-40],
+         [-50,-40,-30,-30,-30,-30,-40,-50]],
+    'B':[[-20,-10,-10,-10,-10,-10,-10,-20],
+         [-10,  0,  0,  0,  0,  0,  0,-10],
+         [-10,  0,  5, 10, 10,  5,  0,-10],
+         [-10,  5,  5, 10, 10,  5,  5,-10],
+         [-10,  0, 10, 10, 10, 10,  0,-10],
+         [-10, 10, 10, 10, 10, 10, 10,-10],
+         [-10,  5,  0,  0,  0,  0,  5,-10],
+         [-20,-10,-10,-10,-10,-10,-10,-20]],
+    'R':[[  0,  0,  0,  0,  0,  0,  0,  0],
+         [  5, 10, 10, 10, 10, 10, 10,  5],
+         [ -5,  0,  0,  0,  0,  0,  0, -5],
+         [ -5,  0,  0,  0,  0,  0,  0, -5],
+         [ -5,  0,  0,  0,  0,  0,  0, -5],
+         [ -5,  0,  0,  0,  0,  0,  0, -5],
+         [ -5,  0,  0,  0,  0,  0,  0, -5],
+         [  0,  0,  0,  5,  5,  0,  0,  0]],
+    'Q':[[-20,-10,-10, -5, -5,-10,-10,-20],
+         [-10,  0,  0,  0,  0,  0,  0,-10],
+         [-10,  0,  5,  5,  5,  5,  0,-10],
+         [ -5,  0,  5,  5,  5,  5,  0, -5],
+         [  0,  0,  5,  5,  5,  5,  0, -5],
+         [-10,  5,  5,  5,  5,  5,  0,-10],
+         [-10,  0,  5,  0,  0,  0,  0,-10],
+         [-20,-10,-10, -5, -5,-10,-10,-20]],
+    'K':[[-30,-40,-40,-50,-50,-40,-40,-30],
+         [-30,-40,-40,-50,-50,-40,-40,-30],
+         [-30,-40,-40,-50,-50,-40,-40,-30],
+         [-30,-40,-40,-50,-50,-40,-40,-30],
+         [-20,-30,-30,-40,-40,-30,-30,-20],
+         [-10,-20,-20,-20,-20,-20,-20,-10],
+         [ 20, 20,  0,  0,  0,  0, 20, 20],
+         [ 20, 30, 10,  0,  0, 10, 30, 20]],
+}
+
+''' material + square bonus of every piece on every square (square = row*8 + col), positive for white'''
+def buildPieceSquareScores():
+    scores = {}
+    for piece, table in PIECE_SQUARE_TABLES.items():
+        scores['w' + piece] = [PIECE_VALUES[piece] + table[sq >> 3][sq & 7] for sq in range(64)]
+        scores['b' + piece] = [-(PIECE_VALUES[piece] + table[7 - (sq >> 3)][sq & 7]) for sq in range(64)]
+    return scores
+
+PIECE_SQUARE_SCORES = buildPieceSquareScores()
@@ -5,16 +5,14 @@ import pygame as p
 import ChessEngine
 import sys
 import os
-
-''' Initilaize pygame font & sound library'''
-p.init()
-p.font.init() 
-p.mixer.init()
+import threading
+from collections import OrderedDict
 
 ''' CONSTANTS '''
 GAME_WIDTH = 1280
 GAME_HEIGHT = 720
 FPS = 30
+DIRTY_RECT_RENDERING = True # redraw and update only the parts of the game screen that changed, and sleep until an event when idle
 DIMENSION = 8 # board
 TILE_SIZE = 90 # tile
 IMAGES={}
@@ -32,39 +30,138 @@ INPUT = {'white':'Guest','black':'Guest','time':''}
 undo_width = BUTTON_WIDTH - 60
 undo_height = BUTTON_HEIGHT - 50
 
+''' ASSETS '''
+# images, fonts and sounds are loaded the first time they are used (and kept), scaled images are kept by size
+IMAGE_FILES = {'icon':'assets/icon.png',
+               'background':os.path.join('assets','main menu','background.png'),
+               'logo':'assets/main menu/logo.png',
+               'play_button':'assets/main menu/play_button.png',
+               'quit_button':'assets/main menu/quit_button.png',
+               'start_button':'assets/game setup/start_button.png',
+               'back_button':'assets/game setup/back_button.png',
+               'undo_button':'assets/game/undo_button.png',
+               'white_queen':'assets/game setup/white_queen.png',
+               'black_queen':'assets/game setup/black_queen.png'}
+PIECES = ['wp','wR','wN','wK','wQ','wB','bp','bR','bN','bK','bQ','bB']
+for piece in PIECES:
+    IMAGE_FILES[piece] = 'assets/game/'+piece+'.png'
+FONT_FILE = 'assets/fonts/Minecraft.ttf'
+FONT_SIZES = {'default':50,'big':110,'user':35,'name':30,'result':75,'undo_reset':30}
+SOUND_FILES = {'button_click':os.path.join('assets','audio','button_click.wav'),
+               'move_piece':'assets/audio/move_piece.wav'}
+# sizes the screens use, loaded by preloadAssets
+PIECE_SIZE = (TILE_SIZE-20,TILE_SIZE-20)
+QUEEN_SETUP_SIZE = (87,63)
+LOGO_SIZE = (376,397)
+ASSETS = {} # (kind, name, size) -> loaded asset
+ASSETS_LOCK = threading.RLock() # preloadAssets fills ASSETS from another thread
+
+''' the image called name, scaled to size if one is given'''
+def image(name,size=None):
+    key = ('image',name,size)
+    surface = ASSETS.get(key)
+    if surface is None:
+        with ASSETS_LOCK:
+            surface = ASSETS.get(key)
+            if surface is None:
+                if size is None:
+                    surface = p.image.load(IMAGE_FILES[name])
+                else:
+                    surface = p.transform.scale(image(name),size)
+                ASSETS[key] = surface
+    return surface
+
+def font(name):
+    key = ('font',name,None)
+    loaded = ASSETS.get(key)
+    if loaded is None:
+        with ASSETS_LOCK:
+            loaded = ASSETS.get(key)
+            if loaded is None:
+                if not p.font.get_init():
+                    p.font.init()
+                loaded = ASSETS[key] = p.font.Font(FONT_FILE,FONT_SIZES[name])
+    return loaded
+
+def sound(name):
+    key = ('sound',name,None)
+    loaded = ASSETS.get(key)
+    if loaded is None:
+        with ASSETS_LOCK:
+            loaded = ASSETS.get(key)
+            if loaded is None:
+                if not p.mixer.get_init():
+                    p.mixer.init()
+                loaded = ASSETS[key] = p.mixer.Sound(SOUND_FILES[name])
+    return loaded
+
+''' start the pygame subsystems the assets need, on the calling thread (SDL subsystems aren't initialised from other threads)'''
+def initSubsystems():
+    p.init()
+    if not p.font.get_init():
+        p.font.init()
+    if not p.mixer.get_init():
+        p.mixer.init()
+
+'''
+load every asset now, in a background thread if background is True (so the first frames don't wait on them).
+The subsystems are started here first, the thread only loads files.
+'''
+def preloadAssets(background=True):
+    initSubsystems()
+    def load():
+        image('background',(GAME_WIDTH,GAME_HEIGHT))
+        image('logo',LOGO_SIZE)
+        image('white_queen',QUEEN_SETUP_SIZE)
+        image('black_queen',QUEEN_SETUP_SIZE)
+        for button in OBJECTS:
+            button.getImage()
+        for piece in PIECES:
+            image(piece,PIECE_SIZE)
+        for name in FONT_SIZES:
+            font(name)
+        for name in SOUND_FILES:
+            sound(name)
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load,daemon=True)
+    thread.start()
+    return thread
+
 ''' IMAGES '''
-def load_images():  #* pieces Images
-    pieces =['wp','wR','wN','wK','wQ','wB','bp','bR','bN','bK','bQ','bB']
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load('assets/game/'+piece+'.png'),(TILE_SIZE-20,TILE_SIZE-20))    
-        
-ICON = (p.image.load('assets/icon.png'))
-BACKGROUND_IMAGE = p.transform.scale(p.image.load(os.path.join('assets','main menu','background.png')),(GAME_WIDTH,GAME_HEIGHT))
-MAIN_MENU_LOGO = p.transform.scale(p.image.load('assets/main menu/logo.png'),(376,397))
-PLAY_BUTTON_IMAGE = p.image.load('assets/main menu/play_button.png')
-QUIT_BUTTON_IMAGE = p.image.load('assets/main menu/quit_button.png')
-START_BUTTON_IMAGE = p.image.load('assets/game setup/start_button.png')
-BACK_BUTTON_IMAGE = p.image.load('assets/game setup/back_button.png')
-UNDO_BUTTON_IMAGE = p.image.load('assets/game/undo_button.png')
-WHITE_QUEEN_IMAGE_SETUP = p.transform.scale(p.image.load('assets/game setup/white_queen.png'),(87,63))
-BLACK_QUEEN_IMAGE_SETUP = p.transform.scale(p.image.load('assets/game setup/black_queen.png'),(87,63))
-
-''' FONTS '''
-FONT = p.font.Font('assets/fonts/Minecraft.ttf',50)
-BIG_FONT = p.font.Font('assets/fonts/Minecraft.ttf',110)
-USER_FONT = p.font.Font('assets/fonts/Minecraft.ttf',35)
-NAME_FONT = p.font.Font('assets/fonts/Minecraft.ttf',30)
-RESULT_FONT = p.font.Font('assets/fonts/Minecraft.ttf',75)
-UNDO_RESET_FONT = p.font.Font('assets/fonts/Minecraft.ttf',30)
-
-''' AUDIO'''
-BUTTON_CLICK = p.mixer.Sound(os.path.join('assets','audio','button_click.wav'))
-PIECE_MOVE = p.mixer.Sound('assets/audio/move_piece.wav')
+def load_images():  #* pieces Images (already loaded images are kept)
+    for piece in PIECES:
+        IMAGES[piece] = image(piece,PIECE_SIZE)
+
+''' TEXT CACHE '''
+TEXT_CACHE = OrderedDict() # (font, text, color) -> rendered surface, least recently used first
+TEXT_CACHE_SIZE = 256
+
+''' font.render, but a text already rendered with the same font and color is reused'''
+def renderText(font,text,color):
+    key = (font,text,tuple(color)) # pygame colors can't be dict keys
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        surface = font.render(text,True,color)
+        TEXT_CACHE[key] = surface
+        if len(TEXT_CACHE) > TEXT_CACHE_SIZE:
+            TEXT_CACHE.popitem(last=False)
+    else:
+        TEXT_CACHE.move_to_end(key)
+    return surface
 
 ''' CREATE WINDOW '''
-WINDOW = p.display.set_mode((GAME_WIDTH,GAME_HEIGHT))
-p.display.set_caption("Chess")
-p.display.set_icon(ICON)
+WINDOW = None # opened by createWindow when the first screen is shown
+
+def createWindow():
+    global WINDOW
+    if WINDOW is None:
+        p.init()
+        WINDOW = p.display.set_mode((GAME_WIDTH,GAME_HEIGHT))
+        p.display.set_caption("Chess")
+        p.display.set_icon(image('icon'))
+    return WINDOW
 
 
 ''' GUI CLASSES '''
@@ -74,7 +171,8 @@ class Button(): # https://www.thepythoncode.com/article/make-a-button-using-pyga
         self.y = y
         self.width = width
         self.height = height
-        self.button_img = button_img
+        self.button_img = button_img # name of the image (or a surface), scaled once when it's first drawn
+        self.buttonText = buttonText
         self.onclickFunction = onclickFunction
         self.onePress = onePress
         self.alreadyPressed = False
@@ -87,7 +185,6 @@ class Button(): # https://www.thepythoncode.com/article/make-a-button-using-pyga
         
         self.buttonSurface = p.Surface((self.width, self.height))
         self.buttonRect = p.Rect(self.x, self.y, self.width, self.height)
-        self.buttonSurf = FONT.render(buttonText, True, (20, 20, 20))
         
         
         OBJECTS.append(self)
@@ -98,7 +195,7 @@ class Button(): # https://www.thepythoncode.com/article/make-a-button-using-pyga
         if self.buttonRect.collidepoint(mousePos):
             self.buttonSurface.fill(self.fillColors['hover'])
             if p.mouse.get_pressed(num_buttons=3)[0]:
-                BUTTON_CLICK.play()
+                sound('button_click').play()
                 p.time.delay(10)
                 self.buttonSurface.fill(self.fillColors['pressed'])
                 if self.onePress:
@@ -109,17 +206,25 @@ class Button(): # https://www.thepythoncode.com/article/make-a-button-using-pyga
             else:
                 self.alreadyPressed = False
                 
-        self.buttonSurface.blit(self.buttonSurf, [
-                                self.buttonRect.width/2 - self.buttonSurf.get_rect().width/2,
-                                self.buttonRect.height/2 - self.buttonSurf.get_rect().height/2
+        buttonSurf = renderText(font('default'),self.buttonText,(20, 20, 20))
+        self.buttonSurface.blit(buttonSurf, [
+                                self.buttonRect.width/2 - buttonSurf.get_rect().width/2,
+                                self.buttonRect.height/2 - buttonSurf.get_rect().height/2
                                                  ])
         
-    def draw(self):
-        if self.button_img != None:
+    def getImage(self):
+        if isinstance(self.button_img,str):
+            return image(self.button_img,(self.width,self.height))
+        if self.button_img != None and self.button_img.get_size() != (self.width,self.height):
             self.button_img = p.transform.scale(self.button_img,(self.width,self.height))
-            WINDOW.blit(self.button_img, (self.x, self.y))
+        return self.button_img
+
+    def draw(self,screen=None):
+        screen = WINDOW if screen is None else screen
+        if self.button_img != None:
+            screen.blit(self.getImage(), (self.x, self.y))
         else:
-            WINDOW.blit(self.buttonSurface, self.buttonRect)
+            screen.blit(self.buttonSurface, self.buttonRect)
     
     def get_width(self):
         return self.ship_img.get_width()
@@ -133,7 +238,7 @@ class InputBox:
         self.rect = p.Rect(x, y, w, h)
         self.color = COLOR_INACTIVE
         self.text = text
-        self.txt_surface = FONT.render(text, True, self.color)
+        self.txt_surface = None # rendered when the box is first shown
         self.active = False
         self.tag = tag
         
@@ -158,14 +263,18 @@ class InputBox:
                 else:
                     self.text += event.unicode
                 # Re-render the text.
-                self.txt_surface = USER_FONT.render(self.text, True, self.color)
+                self.txt_surface = renderText(font('user'),self.text,self.color)
 
     def update(self):
+        if self.txt_surface is None:
+            self.txt_surface = renderText(font('default'),self.text,self.color)
         # Resize the box if the text is too long.
         width = max(200, self.txt_surface.get_width()+10)
         self.rect.w = width
 
     def draw(self, screen):
+        if self.txt_surface is None:
+            self.txt_surface = renderText(font('default'),self.text,self.color)
         # Blit the text.
         WINDOW.blit(self.txt_surface, (self.rect.x+5, self.rect.y+5))
         # Blit the rect.
@@ -191,7 +300,35 @@ def drawBoard(screen):
     for r in range(DIMENSION):
         for c in range(DIMENSION):
             color = colors[((r+c)%2)]
-            p.draw.rect(screen,color,p.Rect(c*TILE_SIZE+GAME_WIDTH//4-45,r*TILE_SIZE,TILE_SIZE,TILE_SIZE))
+            p.draw.rect(screen,color,squareRect(r,c))
+
+def squareRect(r,c):
+    return p.Rect(c*TILE_SIZE+GAME_WIDTH//4-45,r*TILE_SIZE,TILE_SIZE,TILE_SIZE)
+
+HIGHLIGHTS = {} # color -> transparent square
+
+def highlightSurface(color):
+    surface = HIGHLIGHTS.get(color)
+    if surface is None:
+        surface = p.Surface((TILE_SIZE,TILE_SIZE))
+        surface.set_alpha(150)
+        surface.fill(p.Color(color))
+        HIGHLIGHTS[color] = surface
+    return surface
+
+''' draw one square with its highlight and piece, and return its rect (the square is copied from layer if one is given)'''
+def drawSquare(screen,r,c,piece,highlightColor=None,layer=None):
+    colors = [p.Color('white'),p.Color('gray')]
+    rect = squareRect(r,c)
+    if layer is not None:
+        screen.blit(layer,rect,rect)
+    else:
+        p.draw.rect(screen,colors[(r+c)%2],rect)
+    if highlightColor is not None:
+        screen.blit(highlightSurface(highlightColor),rect.topleft)
+    if piece != '--':
+        screen.blit(IMAGES[piece],(rect.x+8,rect.y+10))
+    return rect
             
 def drawPieces(screen,board):
     for r in range(DIMENSION):
@@ -203,49 +340,93 @@ def drawPieces(screen,board):
 def drawResult(text):
     
     
-    result_text = RESULT_FONT.render(text,1,(100,100,100))
-    result_text_shadow = RESULT_FONT.render(text,1,(0,0,0))
+    result_text = renderText(font('result'),text,(100,100,100))
+    result_text_shadow = renderText(font('result'),text,(0,0,0))
 
     WINDOW.blit(result_text_shadow,((GAME_WIDTH-result_text.get_width())//2+4,(GAME_HEIGHT-result_text_shadow.get_height())//2+4))
     WINDOW.blit(result_text,((GAME_WIDTH-result_text.get_width())//2,(GAME_HEIGHT-result_text_shadow.get_height())//2))
     
-    undo_resest_text = UNDO_RESET_FONT.render('Press Z/R to Undo/Restart',1,(100,100,100))
-    undo_resest_text_shadow = UNDO_RESET_FONT.render('Press Z/R to Undo/Restart',1,(0,0,0))
+    undo_resest_text = renderText(font('undo_reset'),'Press Z/R to Undo/Restart',(100,100,100))
+    undo_resest_text_shadow = renderText(font('undo_reset'),'Press Z/R to Undo/Restart',(0,0,0))
     WINDOW.blit(undo_resest_text_shadow,((GAME_WIDTH-undo_resest_text_shadow.get_width())//2+2,(GAME_HEIGHT-undo_resest_text_shadow.get_height())//2+2+50))
     WINDOW.blit(undo_resest_text,((GAME_WIDTH-undo_resest_text.get_width())//2,(GAME_HEIGHT-undo_resest_text.get_height())//2+50))
         
+''' {(row,col): color} of the selected square and the squares its piece can move to'''
+def highlightedSquares(gl,validMoves,selected):
+    squares = {}
+    if selected != ():
+        r,c = selected[0],selected[1]
+        if gl.board[r][c][0] == ('w' if gl.whiteToMove else 'b'): # selected is a piece that can be moved
+            squares[(r,c)] = 'blue'
+            for move in validMoves:
+                if move.startRow == r and move.startCol == c:
+                    squares[(move.endRow,move.endCol)] = 'cadetblue2'
+    return squares
+
 def highlight(screen,gl,validMoves,selected):
     if selected != ():
         r,c = selected[0],selected[1]
         # c*TILE_SIZE +(GAME_WIDTH//4-45) = location[0]-(GAME_WIDTH//4-45)
         if gl.board[r][c][0] == ('w' if gl.whiteToMove else 'b'): # selected is a piece that can be moved
             # highlight selected square
-            highlight_rect = p.Surface((TILE_SIZE,TILE_SIZE))
-            highlight_rect.set_alpha(150)
-            highlight_rect.fill(p.Color('blue'))
-            screen.blit(highlight_rect,(c*TILE_SIZE +(GAME_WIDTH//4-45),r*TILE_SIZE))
+            screen.blit(highlightSurface('blue'),(c*TILE_SIZE +(GAME_WIDTH//4-45),r*TILE_SIZE))
             # highlight moves
-            highlight_rect.fill(p.Color('cadetblue2'))
+            highlight_rect = highlightSurface('cadetblue2')
             for move in validMoves:
                 if move.startRow == r and move.startCol == c:
                     screen.blit(highlight_rect,(move.endCol*TILE_SIZE+(GAME_WIDTH//4-45),move.endRow*TILE_SIZE))     
 
 
     
+''' STATIC LAYERS '''
+LAYERS = {} # screen name -> (arguments it was drawn with, surface): the parts of a screen that don't change
+
+''' the layer drawn by build(layer,*args), drawn again only if args are different from last time'''
+def staticLayer(name,build,*args):
+    entry = LAYERS.get(name)
+    if entry is None or entry[0] != args:
+        layer = p.Surface((GAME_WIDTH,GAME_HEIGHT)).convert()
+        build(layer,*args)
+        entry = LAYERS[name] = (args,layer)
+    return entry[1]
+
+def drawMainmenuLayer(screen):
+    logo = image('logo',LOGO_SIZE)
+    screen.fill((WHITE))
+    screen.blit(image('background',(GAME_WIDTH,GAME_HEIGHT)),(0,0))
+    screen.blit(logo,((GAME_WIDTH-logo.get_width())//2,(GAME_HEIGHT-logo.get_height())//2-150))
+    PLAY_BUTTON.draw(screen)
+    QUIT_BUTTON.draw(screen)
+
+''' background, back button, board squares, queens and player names'''
+def drawGameLayer(screen,wP,bP):
+    whiteQueen = image('white_queen',QUEEN_SETUP_SIZE)
+    blackQueen = image('black_queen',QUEEN_SETUP_SIZE)
+    screen.fill(WHITE)
+    screen.blit(image('background',(GAME_WIDTH,GAME_HEIGHT)),(0,0))
+    GAME_BACK_BUTTON.draw(screen)
+    drawBoard(screen)
+    # users
+    screen.blit(blackQueen,(blackQueen.get_width()//2,70))
+    screen.blit(whiteQueen,(whiteQueen.get_width()//2,GAME_HEIGHT-130))
+    wtext = renderText(font('name'),'{}'.format(wP),(0,0,0))
+    btext = renderText(font('name'),'{}'.format(bP),(0,0,0))
+    wtextshadow = renderText(font('name'),'{}'.format(wP),(150,150,150))
+    btextshadow = renderText(font('name'),'{}'.format(bP),(150,150,150))
+    screen.blit(btextshadow,(blackQueen.get_width()//2+100+3,70+(blackQueen.get_height()+btext.get_height())//4+3))
+    screen.blit(wtextshadow,(whiteQueen.get_width()//2+100+3,GAME_HEIGHT-130+(whiteQueen.get_height()+btext.get_height())//4+3))
+    screen.blit(btext,(blackQueen.get_width()//2+100,70+(blackQueen.get_height()+btext.get_height())//4))
+    screen.blit(wtext,(whiteQueen.get_width()//2+100,GAME_HEIGHT-130+(whiteQueen.get_height()+btext.get_height())//4))
+
 ''' MAIN '''
 def drawMainmenu():
-
-    WINDOW.fill((WHITE))
-    WINDOW.blit(BACKGROUND_IMAGE,(0,0))
-    WINDOW.blit(MAIN_MENU_LOGO,((GAME_WIDTH-MAIN_MENU_LOGO.get_width())//2,(GAME_HEIGHT-MAIN_MENU_LOGO.get_height())//2-150))
-    
-    PLAY_BUTTON.draw()
-    QUIT_BUTTON.draw()
+    WINDOW.blit(staticLayer('menu',drawMainmenuLayer),(0,0))
     # text = FONT.render('Text',1,WHITE)
     # WINDOW.blit(text,(45,20))
     p.display.update()
 
 def MainMenu():
+    createWindow()
     clock = p.time.Clock()
     run = True
 
@@ -267,34 +448,39 @@ def MainMenu():
             object.process()
   
   
-def drawGameSetup():
-    WINDOW.fill(WHITE)
-    WINDOW.blit(BACKGROUND_IMAGE,(0,0))
+def drawGameSetupLayer(screen):
+    whiteQueen = image('white_queen',QUEEN_SETUP_SIZE)
+    blackQueen = image('black_queen',QUEEN_SETUP_SIZE)
+    screen.fill(WHITE)
+    screen.blit(image('background',(GAME_WIDTH,GAME_HEIGHT)),(0,0))
     
-    Setup = BIG_FONT.render('Setup',1,(0,0,0))
-    SetupShadow = BIG_FONT.render('Setup',1,(150,150,150))
-    WINDOW.blit(SetupShadow,((GAME_WIDTH-Setup.get_width())//2+4,100+4))  
-    WINDOW.blit(Setup,((GAME_WIDTH-Setup.get_width())//2,100))
-
-
-    white = FONT.render('White',1,(0,0,0))
-    black = FONT.render('Black',1,(0,0,0))
-    whiteshadow = FONT.render('White',1,(150,150,150))
-    blackshadow = FONT.render('Black',1,(150,150,150))
-    WINDOW.blit(blackshadow,(GAME_WIDTH*3/4-black.get_width()//2+4,GAME_HEIGHT//4+79))
-    WINDOW.blit(whiteshadow,(GAME_WIDTH//4-white.get_width()//2+4,GAME_HEIGHT//4+79))
-    WINDOW.blit(black,(GAME_WIDTH*3/4-black.get_width()//2,GAME_HEIGHT//4+75))
-    WINDOW.blit(white,(GAME_WIDTH//4-white.get_width()//2,GAME_HEIGHT//4+75))
-    WINDOW.blit(BLACK_QUEEN_IMAGE_SETUP,(GAME_WIDTH*3/4-BLACK_QUEEN_IMAGE_SETUP.get_width()//2,GAME_HEIGHT//4))
-    WINDOW.blit(WHITE_QUEEN_IMAGE_SETUP,(GAME_WIDTH//4-WHITE_QUEEN_IMAGE_SETUP.get_width()//2,GAME_HEIGHT//4))
+    Setup = renderText(font('big'),'Setup',(0,0,0))
+    SetupShadow = renderText(font('big'),'Setup',(150,150,150))
+    screen.blit(SetupShadow,((GAME_WIDTH-Setup.get_width())//2+4,100+4))  
+    screen.blit(Setup,((GAME_WIDTH-Setup.get_width())//2,100))
+
+
+    white = renderText(font('default'),'White',(0,0,0))
+    black = renderText(font('default'),'Black',(0,0,0))
+    whiteshadow = renderText(font('default'),'White',(150,150,150))
+    blackshadow = renderText(font('default'),'Black',(150,150,150))
+    screen.blit(blackshadow,(GAME_WIDTH*3/4-black.get_width()//2+4,GAME_HEIGHT//4+79))
+    screen.blit(whiteshadow,(GAME_WIDTH//4-white.get_width()//2+4,GAME_HEIGHT//4+79))
+    screen.blit(black,(GAME_WIDTH*3/4-black.get_width()//2,GAME_HEIGHT//4+75))
+    screen.blit(white,(GAME_WIDTH//4-white.get_width()//2,GAME_HEIGHT//4+75))
+    screen.blit(blackQueen,(GAME_WIDTH*3/4-blackQueen.get_width()//2,GAME_HEIGHT//4))
+    screen.blit(whiteQueen,(GAME_WIDTH//4-whiteQueen.get_width()//2,GAME_HEIGHT//4))
     
-    time = FONT.render('Time',1,(0,0,0))
-    timeshadow = FONT.render('Time',1,(150,150,150))
-    WINDOW.blit(timeshadow,((GAME_WIDTH-time.get_width())//2+4,375+4))  
-    WINDOW.blit(time,((GAME_WIDTH-time.get_width())//2,375))
+    time = renderText(font('default'),'Time',(0,0,0))
+    timeshadow = renderText(font('default'),'Time',(150,150,150))
+    screen.blit(timeshadow,((GAME_WIDTH-time.get_width())//2+4,375+4))  
+    screen.blit(time,((GAME_WIDTH-time.get_width())//2,375))
     
-    START_BUTTON.draw()
-    BACK_BUTTON.draw()
+    START_BUTTON.draw(screen)
+    BACK_BUTTON.draw(screen)
+
+def drawGameSetup():
+    WINDOW.blit(staticLayer('setup',drawGameSetupLayer),(0,0))
     for box in input_boxes:
         box.draw(WINDOW)
 
@@ -302,6 +488,7 @@ def drawGameSetup():
     p.display.update()
            
 def GameSetup():
+    createWindow()
     clock = p.time.Clock()
     run = True
     while run:
@@ -331,40 +518,79 @@ def GameSetup():
 
        
 def drawGame(screen,gl,validMoves,selected,wP,bP,last_move,whiteWon,blackWon,draw):
-    WINDOW.fill(WHITE)
-    WINDOW.blit(BACKGROUND_IMAGE,(0,0))
-    GAME_BACK_BUTTON.draw()
+    screen.blit(staticLayer('game',drawGameLayer,wP,bP),(0,0))
     # board
-    drawChess(WINDOW,gl,validMoves,selected)
-    # users
-    WINDOW.blit(BLACK_QUEEN_IMAGE_SETUP,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2,70))
-    WINDOW.blit(WHITE_QUEEN_IMAGE_SETUP,(WHITE_QUEEN_IMAGE_SETUP.get_width()//2,GAME_HEIGHT-130))
-    wtext = NAME_FONT.render('{}'.format(wP),1,(0,0,0))
-    btext = NAME_FONT.render('{}'.format(bP),1,(0,0,0))
-    wtextshadow = NAME_FONT.render('{}'.format(wP),1,(150,150,150))
-    btextshadow = NAME_FONT.render('{}'.format(bP),1,(150,150,150))
-    WINDOW.blit(btextshadow,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2+100+3,70+(BLACK_QUEEN_IMAGE_SETUP.get_height()+btext.get_height())//4+3))
-    WINDOW.blit(wtextshadow,(WHITE_QUEEN_IMAGE_SETUP.get_width()//2+100+3,GAME_HEIGHT-130+(WHITE_QUEEN_IMAGE_SETUP.get_height()+btext.get_height())//4+3))
-    WINDOW.blit(btext,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2+100,70+(BLACK_QUEEN_IMAGE_SETUP.get_height()+btext.get_height())//4))
-    WINDOW.blit(wtext,(WHITE_QUEEN_IMAGE_SETUP.get_width()//2+100,GAME_HEIGHT-130+(WHITE_QUEEN_IMAGE_SETUP.get_height()+btext.get_height())//4))
-    # last move
-    last_move_text = NAME_FONT.render('Last Move:',1,(0,0,0))
-    last_move_notation = NAME_FONT.render('{}'.format(last_move),1,(20,20,20))
-    last_move_text_shadow = NAME_FONT.render('Last Move:',1,(150,150,150))
-    last_move_notation_shadow = NAME_FONT.render('{}'.format(last_move),1,(150,150,150))
-    WINDOW.blit(last_move_text_shadow,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2-2,(GAME_HEIGHT-last_move_text_shadow.get_height())//2+3))
-    WINDOW.blit(last_move_text,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2-5,(GAME_HEIGHT-last_move_text_shadow.get_height())//2))
-    WINDOW.blit(last_move_notation_shadow,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2+last_move_text.get_width()-2,(GAME_HEIGHT-last_move_text_shadow.get_height())//2+3))
-    WINDOW.blit(last_move_notation,(BLACK_QUEEN_IMAGE_SETUP.get_width()//2+last_move_text.get_width()-5,(GAME_HEIGHT-last_move_text_shadow.get_height())//2))
+    highlight(screen,gl,validMoves,selected)
+    drawPieces(screen,gl.board)
+    lastMoveRect = drawLastMove(last_move)
     
     if whiteWon:drawResult('White Won!')
     if blackWon:drawResult('Black Won!')
     if draw:drawResult('Draw!')
+    return lastMoveRect
+
+''' 'Last Move:' and the notation of the last move, returns the rect they are drawn in'''
+def drawLastMove(last_move):
+    blackQueen = image('black_queen',QUEEN_SETUP_SIZE)
+    last_move_text = renderText(font('name'),'Last Move:',(0,0,0))
+    last_move_notation = renderText(font('name'),'{}'.format(last_move),(20,20,20))
+    last_move_text_shadow = renderText(font('name'),'Last Move:',(150,150,150))
+    last_move_notation_shadow = renderText(font('name'),'{}'.format(last_move),(150,150,150))
+    rect = WINDOW.blit(last_move_text_shadow,(blackQueen.get_width()//2-2,(GAME_HEIGHT-last_move_text_shadow.get_height())//2+3))
+    rect.union_ip(WINDOW.blit(last_move_text,(blackQueen.get_width()//2-5,(GAME_HEIGHT-last_move_text_shadow.get_height())//2)))
+    rect.union_ip(WINDOW.blit(last_move_notation_shadow,(blackQueen.get_width()//2+last_move_text.get_width()-2,(GAME_HEIGHT-last_move_text_shadow.get_height())//2+3)))
+    rect.union_ip(WINDOW.blit(last_move_notation,(blackQueen.get_width()//2+last_move_text.get_width()-5,(GAME_HEIGHT-last_move_text_shadow.get_height())//2)))
+    return rect
+
+'''
+DIRTY RECTANGLES: draw only what changed since the last frame and return the rects to update on the display.
+view keeps what is on the screen: the board, highlighted squares, last move and result ({} before the first frame)
+'''
+def drawGameDirty(screen,gl,validMoves,selected,wP,bP,last_move,whiteWon,blackWon,draw,view):
+    result = (whiteWon,blackWon,draw)
+    highlights = highlightedSquares(gl,validMoves,selected)
+    rects = []
+    redraw = not view or view['result'] != result
+    if not redraw and any(result):
+        # the banner is already on the screen, it's only drawn again when something under it changes
+        redraw = gl.board != view['board'] or highlights != view['highlights'] or last_move != view['lastMove']
+    if redraw:
+        # first frame, the result banner shows up or is taken away (undo or restart), or the board under it changed:
+        # draw everything once, the banner is drawn on top of a clean board
+        view['lastMoveRect'] = drawGame(screen,gl,validMoves,selected,wP,bP,last_move,whiteWon,blackWon,draw)
+        rects = [screen.get_rect()]
+    elif not any(result):
+        textArea = None
+        if last_move != view['lastMove']: # clear the old text, it can run over the edge of the board
+            textArea = view['lastMoveRect']
+            screen.blit(staticLayer('game',drawGameLayer,wP,bP),textArea,textArea)
+            rects.append(textArea)
+        drawnBoard = view['board']
+        drawnHighlights = view['highlights']
+        layer = staticLayer('game',drawGameLayer,wP,bP)
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                piece = gl.board[r][c]
+                color = highlights.get((r,c))
+                if piece != drawnBoard[r][c] or color != drawnHighlights.get((r,c)) or \
+                        textArea is not None and textArea.colliderect(squareRect(r,c)):
+                    rects.append(drawSquare(screen,r,c,piece,color,layer))
+        if textArea is not None:
+            view['lastMoveRect'] = drawLastMove(last_move)
+            rects.append(view['lastMoveRect'])
+    view['board'] = [row[:] for row in gl.board]
+    view['highlights'] = highlights
+    view['lastMove'] = last_move
+    view['result'] = result
+    return rects
 
 def game():
+    createWindow()
 
     clock = p.time.Clock()
+    moveCache = ChessEngine.MoveCache(maxEntries=5000) # undoing (Z) goes back to positions already seen
     gl = ChessEngine.GameLogic()
+    gl.moveCache = moveCache
     validMoves = gl.getValidMoves()
     moveMade = False  # flag for when a move is made
 
@@ -387,13 +613,17 @@ def game():
     # whiteTimer = time
     # blackTimer = time
     last_move = ''
+    view = {} # what drawGameDirty last put on the screen
     gameOver = False
     whiteWon = False
     blackWon = False
     draw = False
     run = True
     while run:
-        for event in p.event.get():
+        events = p.event.get()
+        if not events and DIRTY_RECT_RENDERING and view:
+            events = [p.event.wait()] # nothing changes until the next event, don't use the CPU while idle
+        for event in events:
             
             if event.type == p.QUIT:
                 run = False
@@ -420,7 +650,7 @@ def game():
                             for i in range(len(validMoves)):
                                 if move == validMoves[i]:
                                     last_move = move.getChessNotation()
-                                    PIECE_MOVE.play()
+                                    sound('move_piece').play()
                                     gl.make_move(validMoves[i])
                                     moveMade = True
                                     selected = () #reset clicks
@@ -441,6 +671,7 @@ def game():
                 # RESET
                 if event.key == p.K_r:
                     gl=ChessEngine.GameLogic()
+                    gl.moveCache = moveCache
                     validMoves = gl.getValidMoves()
                     selected = ()
                     playerClicks = []
@@ -454,6 +685,9 @@ def game():
         if moveMade:
             validMoves = gl.getValidMoves()
             moveMade = False
+            if gl.getGameState(validMoves) in ChessEngine.DRAW_RULES: # repetition, fifty moves or no mating material
+                gameOver = True
+                draw = True
 
         if gl.checkMate:
             gameOver = True
@@ -468,19 +702,24 @@ def game():
         
         OBJECTS[4].process()
         
-        drawGame(WINDOW,gl,validMoves,selected,whitePlayer,blackPlayer,last_move,whiteWon,blackWon,draw)
+        if DIRTY_RECT_RENDERING:
+            rects = drawGameDirty(WINDOW,gl,validMoves,selected,whitePlayer,blackPlayer,last_move,whiteWon,blackWon,draw,view)
+            if rects:
+                p.display.update(rects)
+        else:
+            drawGame(WINDOW,gl,validMoves,selected,whitePlayer,blackPlayer,last_move,whiteWon,blackWon,draw)
+            p.display.update()
         clock.tick(FPS)
-        p.display.update()
         # p.display.flip()
 
 ''' BUTTONS '''
-PLAY_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150,BUTTON_WIDTH,BUTTON_HEIGHT, PLAY_BUTTON_IMAGE, '', GameSetup)
-QUIT_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2,PLAY_BUTTON.y+110,BUTTON_WIDTH,BUTTON_HEIGHT, QUIT_BUTTON_IMAGE, '', quit_function)
-START_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2+200,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150+110,BUTTON_WIDTH,BUTTON_HEIGHT, START_BUTTON_IMAGE, '', game)
-BACK_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2-200,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150+110,BUTTON_WIDTH,BUTTON_HEIGHT, BACK_BUTTON_IMAGE, '', MainMenu)
+PLAY_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150,BUTTON_WIDTH,BUTTON_HEIGHT, 'play_button', '', GameSetup)
+QUIT_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2,PLAY_BUTTON.y+110,BUTTON_WIDTH,BUTTON_HEIGHT, 'quit_button', '', quit_function)
+START_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2+200,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150+110,BUTTON_WIDTH,BUTTON_HEIGHT, 'start_button', '', game)
+BACK_BUTTON = Button((GAME_WIDTH-BUTTON_WIDTH)//2-200,(GAME_HEIGHT-BUTTON_HEIGHT)//2+150+110,BUTTON_WIDTH,BUTTON_HEIGHT, 'back_button', '', MainMenu)
 
-GAME_BACK_BUTTON = Button(GAME_WIDTH-undo_width-10,GAME_HEIGHT-undo_height-30,undo_width,BUTTON_HEIGHT-30, BACK_BUTTON_IMAGE, '', GameSetup)
-# UNDO_BUTON = Button(GAME_WIDTH-undo_width-20,GAME_HEIGHT-undo_height-20,undo_width,undo_height,UNDO_BUTTON_IMAGE,'',undo_button_function)
+GAME_BACK_BUTTON = Button(GAME_WIDTH-undo_width-10,GAME_HEIGHT-undo_height-30,undo_width,BUTTON_HEIGHT-30, 'back_button', '', GameSetup)
+# UNDO_BUTON = Button(GAME_WIDTH-undo_width-20,GAME_HEIGHT-undo_height-20,undo_width,undo_height,'undo_button','',undo_button_function)
 
 ''' INPUT '''
 whiteInput = InputBox(GAME_WIDTH//4-100,GAME_HEIGHT//4+50+75, 140, 40,tag='white')
@@ -490,4 +729,6 @@ input_boxes = [whiteInput, blackInput,timeInput]
 
 
 ''' START '''
-if __name__ == '__main__':MainMenu()
\ No newline at end of file
+if __name__ == '__main__':
+    preloadAssets() # the menu shows up right away, the other screens' assets load meanwhile
+    MainMenu()
\ No newline at end of file
@@ -0,0 +1,155 @@
+'''
+Streaming PGN reader and game replay pipeline.
+- readGames reads a PGN file chunk by chunk and yields one PGNGame at a time, so archives of millions of games
+  never have to fit in memory. Every game knows the byte offset it starts at and the offset of the next game,
+  so a run can be restarted from where it stopped.
+- replayGame plays the SAN moves of a game through GameLogic (every move is checked against getValidMoves)
+  and yields a record per position: FEN, number of valid moves, check, checkmate and stalemate flags.
+
+usage: python ChessPGN.py games.pgn [--offset N]   (prints the records as JSON lines)
+'''
+import argparse
+import json
+import re
+import sys
+import ChessEngine
+
+RESULTS = ('1-0','0-1','1/2-1/2','*')
+CHUNK_SIZE = 1 << 16
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+# comments, variations and NAGs are skipped, move numbers (12. or 12...) are dropped from the tokens
+COMMENT_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+')
+
+class PGNGame:
+    def __init__(self,headers,movetext,offset,nextOffset):
+        self.headers = headers
+        self.movetext = movetext
+        self.offset = offset # byte offset of the first line of the game in the file
+        self.nextOffset = offset if nextOffset is None else nextOffset # where the next game starts (to restart from)
+        self.sanMoves, self.result = parseMovetext(movetext)
+
+''' SAN moves and result of the movetext of a game'''
+def parseMovetext(movetext):
+    text = COMMENT_PATTERN.sub(' ',movetext)
+    # take out the variations, they can be nested
+    while '(' in text:
+        stripped = re.sub(r'\([^()]*\)',' ',text)
+        if stripped == text: # unbalanced parenthesis
+            text = text.replace('(',' ')
+        else:
+            text = stripped
+    moves = []
+    result = '*'
+    for token in text.split():
+        if token in RESULTS:
+            result = token
+            continue
+        token = MOVE_NUMBER_PATTERN.sub('',token)
+        if token and not token.startswith('$'):
+            moves.append(token)
+    return moves, result
+
+''' byte lines of the file from offset, read chunkSize bytes at a time, with the offset each line starts at'''
+def readLines(stream,offset=0,chunkSize=CHUNK_SIZE):
+    stream.seek(offset)
+    buffer = b''
+    position = offset # file offset of the start of buffer
+    while True:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            break
+        buffer += chunk
+        lines = buffer.split(b'\n')
+        buffer = lines.pop() # the last line may continue in the next chunk
+        for line in lines:
+            yield position, line
+            position += len(line) + 1
+    if buffer:
+        yield position, buffer
+
+''' yield the games of a PGN file (a path or a binary file object) one by one, starting at a byte offset'''
+def readGames(source,offset=0,chunkSize=CHUNK_SIZE,encoding='utf-8'):
+    stream = open(source,'rb') if isinstance(source,str) else source
+    try:
+        headers = {}
+        movetext = []
+        gameOffset = None
+        for lineOffset, raw in readLines(stream,offset,chunkSize):
+            line = raw.decode(encoding,errors='replace').strip()
+            if line.startswith('['):
+                if movetext: # a header after some moves starts the next game
+                    yield PGNGame(headers,'\n'.join(movetext),gameOffset,lineOffset)
+                    headers = {}
+                    movetext = []
+                    gameOffset = None
+                if gameOffset is None:
+                    gameOffset = lineOffset
+                match = HEADER_PATTERN.match(line)
+                if match:
+                    headers[match.group(1)] = match.group(2)
+            elif line and not line.startswith('%'):
+                if gameOffset is None:
+                    gameOffset = lineOffset
+                movetext.append(line)
+        if headers or movetext:
+            end = stream.seek(0,2)
+            yield PGNGame(headers,'\n'.join(movetext),gameOffset,end)
+    finally:
+        if isinstance(source,str):
+            stream.close()
+
+'''
+play a game through GameLogic and yield a record per position (the start position, then after every move):
+{'ply', 'fen', 'legalMoves', 'check', 'checkMate', 'staleMate', 'state', 'move'} where state is GameLogic.getGameState
+(None while the game goes on) and move is the SAN played from the position.
+Raises ValueError on a move that isn't valid.
+'''
+def replayGame(game,gl=None):
+    fen = game.headers.get('FEN',ChessEngine.STARTING_FEN)
+    if gl is None:
+        gl = ChessEngine.GameLogic(fen)
+    else:
+        gl.load_fen(fen)
+    gl.underPromotions = True
+    for ply in range(len(game.sanMoves) + 1):
+        moves = gl.getValidMoves()
+        check = gl.inCheck()
+        san = game.sanMoves[ply] if ply < len(game.sanMoves) else None
+        yield {'ply':ply,'fen':gl.to_fen(),'legalMoves':len(moves),'check':check,
+               'checkMate':check and len(moves) == 0,'staleMate':not check and len(moves) == 0,
+               'state':gl.getGameState(moves),'move':san}
+        if san is not None:
+            gl.make_move(gl.parseSAN(san,moves))
+
+''' every position of every game from offset on, games with an invalid move end with an {'error'} record'''
+def replayPipeline(source,offset=0,chunkSize=CHUNK_SIZE):
+    gl = ChessEngine.GameLogic()
+    for game in readGames(source,offset,chunkSize):
+        try:
+            for record in replayGame(game,gl):
+                record['offset'] = game.offset
+                yield record
+        except ValueError as error:
+            yield {'offset':game.offset,'error':str(error)}
+
+''' SAN of a list of moves played from the position of gl (gl is left unchanged)'''
+def movesToSAN(gl,moves):
+    sanMoves = []
+    for move in moves:
+        sanMoves.append(gl.getSAN(move))
+        gl.make_move(move)
+    for _ in moves:
+        gl.undo_move()
+    return sanMoves
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay the games of a PGN file and print a JSON record per position')
+    parser.add_argument('pgn')
+    parser.add_argument('--offset',type=int,default=0,help='byte offset of the game to start from')
+    args = parser.parse_args(argv)
+    for record in replayPipeline(args.pgn,args.offset):
+        sys.stdout.write(json.dumps(record) + '\n')
+    return 0
+
+if __name__ == '__main__':sys.exit(main())
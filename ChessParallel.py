@@ -0,0 +1,163 @@
+'''
+Parallel perft and search over several processes (threads don't help, the GIL runs one at a time).
+The valid moves of the root position are split across a pool of worker processes, each worker keeps its own
+GameLogic, sets up the root position from its FEN, plays its root move and works on the position after it.
+Results come back in the order of the root moves so the totals and the chosen move don't depend on timing.
+A search can be given the moves played before the root (history), the workers play them too so repetitions
+of earlier positions are seen as draws, the same as ChessAI.findBestMove on the game.
+'''
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import ChessBitboard
+import ChessAI
+
+BACKENDS = {'mailbox':ChessEngine.GameLogic,'bitboard':ChessBitboard.BitboardGameLogic}
+
+''' WORKER SIDE '''
+_workerLogic = None # the GameLogic of this worker process
+_workerTablebases = {} # directory -> ChessTablebase.Tablebase opened in this worker
+
+def initWorker(backend,underPromotions):
+    global _workerLogic
+    _workerLogic = BACKENDS[backend]()
+    _workerLogic.underPromotions = underPromotions
+
+''' set up the position of fen, play the moves before the root and then the root move (sent as 16 bit codes)'''
+def playRootMove(fen,moveCode,history=()):
+    gl = _workerLogic
+    gl.load_fen(fen)
+    for code in history:
+        gl.make_move(ChessEngine.Move.decode(code,gl.board))
+    gl.make_move(ChessEngine.Move.decode(moveCode,gl.board))
+    return gl
+
+def workerTablebase(directory):
+    if directory is None:
+        return None
+    if directory not in _workerTablebases:
+        import ChessTablebase
+        _workerTablebases[directory] = ChessTablebase.Tablebase(directory)
+    return _workerTablebases[directory]
+
+def perftTask(task):
+    fen, moveCode, depth = task
+    return playRootMove(fen,moveCode).perft(depth)
+
+'''
+search the position after a root move, returns (score, pv codes, nodes, depth) with the depth counted from the root.
+Depth 0 means the budget ran out before the first depth finished and the score is worthless, exact results
+(draws, tablebase positions and forced mates) count as searched to the full depth.
+'''
+def searchTask(task):
+    fen, history, moveCode, depth, timeLimit, nodeLimit, tablebaseDirectory = task
+    gl = playRootMove(fen,moveCode,history)
+    tablebase = workerTablebase(tablebaseDirectory)
+    search = ChessAI.Search(gl,depth,timeLimit,nodeLimit,tablebase)
+    if search.isDraw(): # the root move repeats a position, or ends the game by the fifty-move rule or the material
+        return 0, [], 1, depth + 1
+    if tablebase is not None:
+        found = tablebase.probe(gl)
+        if found is not None:
+            return -ChessAI.tablebaseScore(found[0],found[1],1), [], 1, depth + 1
+    if depth == 0:
+        search.startTime = time.perf_counter()
+        score = search.quiescence(-ChessAI.CHECKMATE - 1,ChessAI.CHECKMATE + 1,1)
+        return -score, [], search.nodes, 1
+    result = search.findBestMove()
+    if result.depth == 0:
+        return 0, [], result.nodes, 0
+    # the score is from the opponent's point of view, and their mates are one ply further from the root
+    score = -result.score
+    if abs(score) >= ChessAI.CHECKMATE - ChessAI.MAX_PLY:
+        score += -1 if score > 0 else 1
+        return score, [move.encode() for move in result.pv], result.nodes, depth + 1
+    return score, [move.encode() for move in result.pv], result.nodes, result.depth + 1
+
+''' MAIN PROCESS SIDE '''
+def makeExecutor(workers=None,backend='mailbox',underPromotions=True):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(),initializer=initWorker,
+                               initargs=(backend,underPromotions))
+
+def rootMoves(fen,backend,underPromotions,history=()):
+    gl = BACKENDS[backend].from_fen(fen)
+    gl.underPromotions = underPromotions
+    for code in history:
+        gl.make_move(ChessEngine.Move.decode(code,gl.board))
+    return gl, gl.getValidMoves()
+
+''' (start FEN, move codes) of the game played on gl, for the history of parallelSearch'''
+def gameHistory(gl):
+    moves = list(gl.moveLog)
+    for _ in moves:
+        gl.undo_move()
+    fen = gl.to_fen()
+    for move in moves:
+        gl.make_move(move)
+    return fen, [move.encode() for move in moves]
+
+''' map the tasks on the executor (or on a new pool of workers processes), results in task order'''
+def runTasks(function,tasks,executor,workers,backend,underPromotions):
+    if executor is not None:
+        return list(executor.map(function,tasks))
+    with makeExecutor(workers,backend,underPromotions) as pool:
+        return list(pool.map(function,tasks))
+
+''' perft split by first move and computed in parallel: {move notation: leaf nodes under it}'''
+def parallelDivide(fen,depth,workers=None,backend='mailbox',underPromotions=True,executor=None):
+    gl, moves = rootMoves(fen,backend,underPromotions)
+    if depth <= 1:
+        return {move.getChessNotation():1 for move in moves}
+    tasks = [(fen,move.encode(),depth - 1) for move in moves]
+    counts = runTasks(perftTask,tasks,executor,workers,backend,underPromotions)
+    return {move.getChessNotation():count for move, count in zip(moves,counts)}
+
+def parallelPerft(fen,depth,workers=None,backend='mailbox',underPromotions=True,executor=None):
+    if depth == 0:
+        return 1
+    return sum(parallelDivide(fen,depth,workers,backend,underPromotions,executor).values())
+
+'''
+search every root move in parallel to maxDepth-1 and return a ChessAI.SearchResult.
+The root is the position of fen after the move codes of history (see gameHistory), like ChessAI.findBestMove
+an opening book or tablebase move is played without searching, and the workers probe the tablebase too.
+The time and node budgets apply to each root move. Only the root moves searched to the deepest depth any
+of them finished are compared, that depth is the depth of the result. Equal scores go to the first root move.
+'''
+def parallelSearch(fen,maxDepth=4,workers=None,timeLimit=None,nodeLimit=None,backend='mailbox',executor=None,
+                   history=(),book=None,tablebase=None):
+    start = time.perf_counter()
+    history = list(history)
+    gl, moves = rootMoves(fen,backend,True,history)
+    if len(moves) == 0:
+        return ChessAI.SearchResult(None,-ChessAI.CHECKMATE if gl.inCheck() else 0,0,[],0,time.perf_counter() - start)
+    if book is not None: # the same shortcuts as ChessAI.findBestMove, before any work is sent to the workers
+        move = book.choose(gl)
+        if move is not None:
+            return ChessAI.SearchResult(move,0,0,[move],0,time.perf_counter() - start)
+    if tablebase is not None:
+        found = tablebase.bestMove(gl)
+        if found is not None:
+            move, result, plies = found
+            return ChessAI.SearchResult(move,ChessAI.tablebaseScore(result,plies,0),1,[move],1,time.perf_counter() - start)
+    tasks = [(fen,history,move.encode(),maxDepth - 1,timeLimit,nodeLimit,tablebase.directory if tablebase else None)
+             for move in moves]
+    results = runTasks(searchTask,tasks,executor,workers,backend,True)
+    nodes = len(moves) + sum(result[2] for result in results)
+    depth = max(result[3] for result in results)
+    if depth == 0: # no root move finished depth 1, play the first valid move like ChessAI.findBestMove
+        return ChessAI.SearchResult(moves[0],0,0,[moves[0]],nodes,time.perf_counter() - start)
+    bestIndex = None
+    for i, result in enumerate(results):
+        if result[3] == depth and (bestIndex is None or result[0] > results[bestIndex][0]):
+            bestIndex = i
+    score, pvCodes, _, _ = results[bestIndex]
+    # rebuild the principal variation as Move objects on the root position
+    pv = [moves[bestIndex]]
+    gl.make_move(moves[bestIndex])
+    for code in pvCodes:
+        move = ChessEngine.Move.decode(code,gl.board)
+        pv.append(move)
+        gl.make_move(move)
+    return ChessAI.SearchResult(moves[bestIndex],score,depth,pv,nodes,time.perf_counter() - start)
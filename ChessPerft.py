@@ -0,0 +1,108 @@
+'''
+Perft benchmark and correctness suite for the move generator.
+Runs the standard perft positions, compares the node counts with the known reference values and reports nodes/sec.
+
+usage: python ChessPerft.py [--depth N] [--position NAME] [--backend mailbox|bitboard] [--divide] [--workers N]
+'''
+import argparse
+import os
+import sys
+import time
+import ChessParallel
+from ChessParallel import BACKENDS
+
+''' (name, FEN, {depth: reference node count}) '''
+POSITIONS = [
+    ('initial','rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     {1:20,2:400,3:8902,4:197281,5:4865609,6:119060324}),
+    ('kiwipete','r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1:48,2:2039,3:97862,4:4085603,5:193690690}),
+    ('position3','8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     {1:14,2:191,3:2812,4:43238,5:674624,6:11030083}),
+    ('position4','r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     {1:6,2:264,3:9467,4:422333,5:15833292}),
+    ('position4-mirrored','r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+     {1:6,2:264,3:9467,4:422333,5:15833292}),
+    ('position5','rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     {1:44,2:1486,3:62379,4:2103487,5:89941194}),
+    ('position6','r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1:46,2:2079,3:89890,4:3894594,5:164075551}),
+    # en-passant, castling and promotion edge cases (depths 1-4 checked against python-chess)
+    ('illegal-ep-1','3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',{1:18,2:92,3:1670,4:10138,6:1134888}),
+    ('illegal-ep-2','8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',{1:13,2:102,3:1266,4:10276,6:1015133}),
+    ('ep-gives-check','8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',{1:15,2:126,3:1928,4:13931,6:1440467}),
+    ('short-castle-check','5k2/8/8/8/8/8/8/4K2R w K - 0 1',{1:15,2:66,3:1198,4:6399,6:661072}),
+    ('long-castle-check','3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',{1:16,2:71,3:1286,4:7418,6:803711}),
+    ('castle-rights','r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',{1:26,2:1141,3:27826,4:1274206}),
+    ('castle-prevented','r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',{1:44,2:1494,3:50509,4:1720476}),
+    ('promote-out-of-check','2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',{1:11,2:133,3:1442,4:19174,6:3821001}),
+    ('discovered-check','8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',{1:29,2:165,3:5160,4:31961,5:1004658}),
+    ('promote-to-check','4k3/1P6/8/8/8/8/K7/8 w - - 0 1',{1:9,2:40,3:472,4:2661,6:217342}),
+    ('underpromote-to-check','8/P1k5/K7/8/8/8/8/8 w - - 0 1',{1:6,2:27,3:273,4:1329,6:92683}),
+    ('self-stalemate','K1k5/8/P7/8/8/8/8/8 w - - 0 1',{1:2,2:6,3:13,4:63,6:2217}),
+    ('stalemate-checkmate-1','8/k1P5/8/1K6/8/8/8/8 w - - 0 1',{1:10,2:25,3:268,4:926,7:567584}),
+    ('stalemate-checkmate-2','8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',{1:37,2:183,3:6559,4:23527}),
+]
+
+''' the depth a position is run at: the deepest reference not over maxDepth, or maxDepth if there is none'''
+def suiteDepth(references,maxDepth):
+    depths = [d for d in references if d <= maxDepth]
+    return max(depths) if depths else maxDepth
+
+''' run perft on every position, print a line per position and return True if every count matches its reference'''
+def runSuite(maxDepth,positions=POSITIONS,backend='mailbox',divide=False,out=sys.stdout,workers=1):
+    logic = BACKENDS[backend]
+    # with more than 1 worker the first moves of each position are split across a pool of processes
+    executor = ChessParallel.makeExecutor(workers,backend) if workers > 1 else None
+    allPassed = True
+    totalNodes = 0
+    totalTime = 0.0
+    for name, fen, references in positions:
+        depth = suiteDepth(references,maxDepth)
+        gl = logic.from_fen(fen)
+        gl.underPromotions = True # the reference counts include every promotion piece
+        start = time.perf_counter()
+        if executor is not None:
+            split = ChessParallel.parallelDivide(fen,depth,backend=backend,executor=executor)
+            nodes = sum(split.values())
+        elif divide:
+            split = gl.divide(depth)
+            nodes = sum(split.values())
+        else:
+            nodes = gl.perft(depth)
+        elapsed = time.perf_counter() - start
+        totalNodes += nodes
+        totalTime += elapsed
+        expected = references.get(depth)
+        if expected is None:
+            status = 'no reference'
+        elif nodes == expected:
+            status = 'OK'
+        else:
+            status = 'FAIL (expected {})'.format(expected)
+            allPassed = False
+        out.write('{:<24} depth {} {:>11} nodes {:>8.2f}s {:>9.0f} nodes/s  {}\n'.format(
+            name,depth,nodes,elapsed,nodes/elapsed if elapsed else 0,status))
+        if divide:
+            for notation in sorted(split):
+                out.write('    {} {}\n'.format(notation,split[notation]))
+    if executor is not None:
+        executor.shutdown()
+    out.write('total {} nodes in {:.2f}s, {:.0f} nodes/s\n'.format(totalNodes,totalTime,totalNodes/totalTime if totalTime else 0))
+    return allPassed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Perft benchmark and correctness suite')
+    parser.add_argument('--depth',type=int,default=3,help='maximum depth to run each position at')
+    parser.add_argument('--position',action='append',help='only run the positions with this name (can be repeated)')
+    parser.add_argument('--backend',choices=sorted(BACKENDS),default='mailbox')
+    parser.add_argument('--divide',action='store_true',help='print the node count under every first move')
+    parser.add_argument('--workers',type=int,default=1,help='number of worker processes (0 for one per CPU core)')
+    args = parser.parse_args(argv)
+    positions = POSITIONS
+    if args.position:
+        positions = [position for position in POSITIONS if position[0] in args.position]
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    return 0 if runSuite(args.depth,positions,args.backend,args.divide,workers=workers) else 1
+
+if __name__ == '__main__':sys.exit(main())
@@ -0,0 +1,188 @@
+'''
+Opt-in instrumentation of a GameLogic: call counts and time of the move generation functions, moves generated
+per piece generator, moves rejected by the legality checks and move cache hits.
+Profiling replaces the methods of one GameLogic object with timed wrappers and puts the class methods back when
+it stops, so a GameLogic that isn't being profiled runs the normal code with no overhead at all.
+
+    profiler = Profiler(gl)
+    with profiler:
+        gl.perft(4)
+    profiler.toJSON('profile.json')      # or profiler.dump_stats('profile.prof'), readable by pstats / snakeviz
+    profiler.print_stats()
+'''
+import json
+import marshal
+import pstats
+import sys
+import time
+
+# methods timed when they exist on the GameLogic (the bitboard backend doesn't have all of them)
+PROFILED_METHODS = ('getValidMoves','generateValidMoves','getValidMovesNaive','checkPinsandChecks','getAllPossibleMoves',
+                    'getCastleMoves','addUnderPromotions','inCheck','underAttack','squareUnderAttack','kingMoveIsSafe',
+                    'enpassantExposesKing','make_move','undo_move','moveRules','getCaptureMoves','hasValidMoves','findCheckInfo',
+                    # BitboardGameLogic
+                    'attackersOf','getPawnBitboardMoves','getCastleBitboardMoves','updateBitboards')
+# the legality checks, and the result that means the move is rejected
+REJECTING_METHODS = {'kingMoveIsSafe':False,'enpassantExposesKing':True}
+
+class FunctionStats:
+    __slots__ = ('calls','seconds','ownSeconds','moves','callers')
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0 # time inside the function, including the profiled functions it calls
+        self.ownSeconds = 0.0 # time not spent in other profiled functions
+        self.moves = 0 # moves added to the list by a piece generator
+        self.callers = {} # name of the calling profiled function -> [calls, seconds]
+
+class Profiler:
+    def __init__(self,gl):
+        self.gl = gl
+        self.enabled = False
+        self.reset()
+
+    ''' clear the counters (a running profiler keeps running)'''
+    def reset(self):
+        running = self.enabled
+        self.stop() # the wrappers hold the stats objects, they are made again on start
+        self.functions = {}
+        self.codes = {} # name -> (file, line, function name) for the cProfile format
+        self.rejections = 0
+        self.seconds = 0.0
+        self.stack = [] # [name, child seconds] of the profiled calls in progress
+        self.cacheStart = self.cacheCounters()
+        if running:
+            self.start()
+
+    def cacheCounters(self):
+        cache = self.gl.moveCache
+        return (cache.hits,cache.misses) if cache is not None else (0,0)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    ''' replace the methods of gl by timed wrappers'''
+    def start(self):
+        if self.enabled:
+            return
+        gl = self.gl
+        for name in PROFILED_METHODS:
+            method = getattr(gl,name,None)
+            if method is not None:
+                setattr(gl,name,self.wrap(name,method))
+        # the piece generators are called through moveFunctions
+        self.moveFunctions = gl.moveFunctions
+        gl.moveFunctions = {piece: self.wrap(function.__name__,function,countMoves=True)
+                            for piece, function in self.moveFunctions.items()}
+        self.enabled = True
+        self.startTime = time.perf_counter()
+
+    ''' put the class methods back'''
+    def stop(self):
+        if not self.enabled:
+            return
+        gl = self.gl
+        for name in PROFILED_METHODS:
+            gl.__dict__.pop(name,None)
+        gl.moveFunctions = self.moveFunctions
+        self.enabled = False
+        self.seconds += time.perf_counter() - self.startTime
+
+    def wrap(self,name,function,countMoves=False):
+        stats = self.functions.setdefault(name,FunctionStats())
+        code = getattr(function,'__code__',None) or function.__func__.__code__
+        self.codes[name] = (code.co_filename,code.co_firstlineno,name)
+        stack = self.stack
+        perf_counter = time.perf_counter
+        rejected = REJECTING_METHODS.get(name)
+        def profiled(*args,**kwargs):
+            frame = [name,0.0]
+            stack.append(frame)
+            movesBefore = len(args[2]) if countMoves else 0
+            start = perf_counter()
+            try:
+                result = function(*args,**kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                stats.calls += 1
+                stats.seconds += elapsed
+                stats.ownSeconds += elapsed - frame[1]
+                caller = stack[-1][0] if stack else None
+                if stack:
+                    stack[-1][1] += elapsed
+                callerStats = stats.callers.get(caller)
+                if callerStats is None:
+                    stats.callers[caller] = [1,elapsed]
+                else:
+                    callerStats[0] += 1
+                    callerStats[1] += elapsed
+            if countMoves:
+                stats.moves += len(args[2]) - movesBefore
+            if rejected is not None and result == rejected:
+                self.rejections += 1
+            return result
+        return profiled
+
+    ''' REPORTS '''
+    def report(self):
+        seconds = self.seconds + (time.perf_counter() - self.startTime if self.enabled else 0)
+        hits, misses = self.cacheCounters()
+        functions = {}
+        for name, stats in self.functions.items():
+            if stats.calls:
+                functions[name] = {'calls':stats.calls,'seconds':stats.seconds,'ownSeconds':stats.ownSeconds}
+                if stats.moves:
+                    functions[name]['moves'] = stats.moves
+        return {'seconds':seconds,'functions':functions,
+                'movesGenerated':sum(stats.moves for stats in self.functions.values()),
+                'legalityRejections':self.rejections,
+                'cacheHits':hits - self.cacheStart[0],'cacheMisses':misses - self.cacheStart[1]}
+
+    ''' the report as a JSON string, also written to path if one is given'''
+    def toJSON(self,path=None):
+        text = json.dumps(self.report(),indent=2)
+        if path is not None:
+            with open(path,'w') as f:
+                f.write(text)
+        return text
+
+    ''' stats in the format of cProfile.Profile.stats, so pstats.Stats(profiler) works'''
+    def create_stats(self):
+        self.stats = {}
+        for name, stats in self.functions.items():
+            if stats.calls:
+                callers = {self.codes[caller]: (calls,calls,seconds,seconds)
+                           for caller, (calls, seconds) in stats.callers.items() if caller is not None}
+                self.stats[self.codes[name]] = (stats.calls,stats.calls,stats.ownSeconds,stats.seconds,callers)
+
+    ''' write the stats in the cProfile file format'''
+    def dump_stats(self,path):
+        self.create_stats()
+        with open(path,'wb') as f:
+            marshal.dump(self.stats,f)
+
+    def print_stats(self,sort='cumulative',stream=sys.stdout):
+        pstats.Stats(self,stream=stream).sort_stats(sort).print_stats()
+
+'''
+profile a short perft and a call with a keyword argument, the profiled methods must give the same results as
+the class methods. Returns True when everything matches.
+'''
+def selfCheck():
+    import ChessEngine
+    gl = ChessEngine.GameLogic('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+    expected = ([move.getChessNotation() for move in gl.getCaptureMoves(checks=True)],gl.perft(2))
+    profiler = Profiler(gl)
+    with profiler:
+        found = ([move.getChessNotation() for move in gl.getCaptureMoves(checks=True)],gl.perft(2))
+    report = profiler.report()['functions']
+    return found == expected and report['getCaptureMoves']['calls'] == 1 and 'getCaptureMoves' not in gl.__dict__
+
+if __name__ == '__main__':
+    ok = selfCheck()
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
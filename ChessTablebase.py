@@ -0,0 +1,434 @@
+'''
+Endgame tablebases: the exact result and distance to mate of every position of small endings (KQK, KRK, KPK,
+KQKR, KRKP, ...), made here by retrograde analysis with GameLogic's move generator.
+
+One file per material, e.g. tablebases/KQK.tb: a header and then one byte per position, indexed by
+side to move * 64**n + the squares of the n pieces (white pieces then black pieces, kings first, in the order KQRBNP).
+The byte is 0 for a draw, 255 for an illegal position, otherwise distance to mate in plies + 1:
+an odd distance is a win for the side to move, an even one a loss (0 = checkmated).
+Tables are memory mapped, so a probe is one index computation and one byte read.
+Positions with the colors the other way around (KKQ) are probed in the table of the mirrored position (KQK).
+Castling rights aren't in the tables and en-passant captures are left out, such positions probe as unknown.
+
+3 piece tables take about a minute each to build, 4 piece ones have 64 times more positions and take an hour or more.
+
+usage: python ChessTablebase.py build [KQK KRK KPK ...] [--dir tablebases]
+       python ChessTablebase.py probe FEN [--dir tablebases]
+'''
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+from ChessEngine import GameLogic
+from ChessBitboard import KING_ATTACKS, KNIGHT_ATTACKS, rookAttacks, bishopAttacks
+
+MAGIC = b'CHTB'
+VERSION = 1
+HEADER = struct.Struct('<4sHH8sQ') # magic, version, number of pieces, material name, number of positions
+DEFAULT_DIRECTORY = 'tablebases'
+DEFAULT_TABLES = ('KQK','KRK','KPK')
+MAX_PIECES = 4
+PIECE_ORDER = 'KQRBNP'
+DRAW_BYTE = 0
+ILLEGAL_BYTE = 255
+MAX_DTM = 253 # longest distance to mate (plies) a byte can hold
+# results of a probe, for the side to move
+WIN, DRAW, LOSS = 1, 0, -1
+
+''' MATERIAL '''
+''' pieces of a material name ('KQK' -> ['wK','wQ','bK']), the board uses p for pawns'''
+def parseMaterial(name):
+    split = name.find('K',1)
+    if not name.startswith('K') or split < 0:
+        raise ValueError('material needs a white and a black king: ' + name)
+    pieces = []
+    for color, part in (('w',name[:split]),('b',name[split:])):
+        if part.count('K') != 1 or any(piece not in PIECE_ORDER for piece in part):
+            raise ValueError('invalid material: ' + name)
+        pieces += [color + (piece if piece != 'P' else 'p') for piece in sortPieces(part)]
+    if len(pieces) > MAX_PIECES:
+        raise ValueError('tablebases have at most {} pieces: {}'.format(MAX_PIECES,name))
+    return pieces
+
+def sortPieces(types):
+    return sorted(types,key=PIECE_ORDER.index)
+
+def materialName(pieces):
+    return ''.join(piece[1].upper() for piece in pieces)
+
+''' True if the white part of the material isn't weaker than the black part (more pieces, or stronger ones)'''
+def whiteIsStronger(white,black):
+    if len(white) != len(black):
+        return len(white) > len(black)
+    return [PIECE_ORDER.index(piece) for piece in white] <= [PIECE_ORDER.index(piece) for piece in black]
+
+''' material no side can mate with (kings and at most one knight or bishop), drawn without a table'''
+def isDrawnMaterial(types):
+    others = [piece for piece in types if piece != 'K']
+    return len(others) == 0 or (len(others) == 1 and others[0] in 'BN')
+
+''' names of the materials a capture or a promotion leads to'''
+def subMaterials(name):
+    pieces = parseMaterial(name)
+    found = set()
+    for i, piece in enumerate(pieces):
+        if piece[1] == 'K':
+            continue
+        found.add(canonicalName(pieces[:i] + pieces[i+1:]))
+        if piece[1] == 'p':
+            for promotion in 'QRBN':
+                found.add(canonicalName(pieces[:i] + [piece[0] + promotion] + pieces[i+1:]))
+    return sorted(found)
+
+def canonicalName(pieces):
+    white = sortPieces(piece[1].upper() for piece in pieces if piece[0] == 'w')
+    black = sortPieces(piece[1].upper() for piece in pieces if piece[0] == 'b')
+    if not whiteIsStronger(white,black):
+        white, black = black, white
+    return ''.join(white) + ''.join(black)
+
+def tablePath(directory,name):
+    return os.path.join(directory,name + '.tb')
+
+''' PROBING '''
+class TableFile:
+    def __init__(self,path):
+        self.file = open(path,'rb')
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, self.pieceCount, name, self.size = HEADER.unpack_from(self.data,0)
+        if magic != MAGIC or version != VERSION or len(self.data) != HEADER.size + self.size:
+            raise ValueError('not a tablebase file: ' + path)
+        self.name = name.rstrip(b'\0').decode()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __getitem__(self,index):
+        return self.data[HEADER.size + index]
+
+class Tablebase:
+    ''' the tables of a directory, opened on first use'''
+    def __init__(self,directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.tables = {} # material name -> TableFile, or None if there is no file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def table(self,name):
+        if name not in self.tables:
+            path = tablePath(self.directory,name)
+            self.tables[name] = TableFile(path) if os.path.exists(path) else None
+        return self.tables[name]
+
+    '''
+    (result, plies) of the position of gl for the side to move: (WIN, plies to mate), (LOSS, plies until mated)
+    or (DRAW, 0). None when the position isn't in the tables (too many pieces, no table, castling or en-passant).
+    '''
+    def probe(self,gl):
+        white, black = [], []
+        count = 0
+        for r, row in enumerate(gl.board):
+            for c, piece in enumerate(row):
+                if piece != '--':
+                    count += 1
+                    if count > MAX_PIECES:
+                        return None
+                    (white if piece[0] == 'w' else black).append((PIECE_ORDER.index(piece[1].upper()),r*8 + c))
+        if gl.currentCastlingRights.mask() or self.enpassantCapture(gl):
+            return None
+        white.sort()
+        black.sort()
+        flipped = not whiteIsStronger([PIECE_ORDER[order] for order, _ in white],[PIECE_ORDER[order] for order, _ in black])
+        if flipped: # mirror the board: colors swap and the ranks flip
+            white, black = [(order,sq ^ 56) for order, sq in black], [(order,sq ^ 56) for order, sq in white]
+        types = [PIECE_ORDER[order] for order, _ in white + black]
+        if isDrawnMaterial(types):
+            return (DRAW,0)
+        table = self.table(''.join(types))
+        if table is None:
+            return None
+        index = 0 if gl.whiteToMove != flipped else 1
+        for _, sq in white + black:
+            index = index * 64 + sq
+        return decodeValue(table[index])
+
+    ''' True if the side to move has a pawn next to the pawn that just moved 2 squares'''
+    def enpassantCapture(self,gl):
+        if gl.enpassantPossible == ():
+            return False
+        r, c = gl.enpassantPossible
+        pawnRow, pawn = (r + 1,'wp') if gl.whiteToMove else (r - 1,'bp')
+        return (c > 0 and gl.board[pawnRow][c-1] == pawn) or (c < 7 and gl.board[pawnRow][c+1] == pawn)
+
+    '''
+    (move, result, plies) of the best valid move of the position of gl: the fastest win, else a draw, else the slowest loss.
+    None when the position or one of its moves isn't in the tables.
+    '''
+    def bestMove(self,gl):
+        if self.probe(gl) is None:
+            return None
+        checkMate, staleMate = gl.checkMate, gl.staleMate
+        moves = gl.getValidMoves()
+        gl.checkMate, gl.staleMate = checkMate, staleMate
+        best = None
+        for move in moves:
+            gl.make_move(move)
+            found = self.probe(gl)
+            gl.undo_move()
+            if found is None:
+                return None
+            result, plies = -found[0], found[1] + 1 # the result of the opponent after the move
+            # ordering key: wins (faster first), draws, losses (slower first)
+            key = (result,-plies if result == WIN else plies)
+            if best is None or key > best[0]:
+                best = (key,move,result,plies if result != DRAW else 0)
+        return best[1:] if best is not None else None
+
+def decodeValue(value):
+    if value == DRAW_BYTE:
+        return (DRAW,0)
+    if value == ILLEGAL_BYTE:
+        return None
+    plies = value - 1
+    return (WIN if plies & 1 else LOSS,plies)
+
+''' BUILDING '''
+''' squares a piece standing on sq can have come from (empty squares it moves to sq from)'''
+def originSquares(piece,sq,occupied):
+    kind = piece[1]
+    if kind == 'K':
+        targets = KING_ATTACKS[sq]
+    elif kind == 'N':
+        targets = KNIGHT_ATTACKS[sq]
+    elif kind == 'R':
+        targets = rookAttacks(sq,occupied)
+    elif kind == 'B':
+        targets = bishopAttacks(sq,occupied)
+    elif kind == 'Q':
+        targets = rookAttacks(sq,occupied) | bishopAttacks(sq,occupied)
+    else: # pawns only move forward, one square or two from their starting row
+        back = 8 if piece[0] == 'w' else -8
+        targets = 0
+        origin = sq + back
+        if 0 <= origin < 64 and not occupied >> origin & 1:
+            targets = 1 << origin
+            if sq >> 3 == (4 if piece[0] == 'w' else 3) and not occupied >> (origin + back) & 1:
+                targets |= 1 << (origin + back)
+    targets &= ~occupied
+    while targets:
+        lsb = targets & -targets
+        yield lsb.bit_length() - 1
+        targets ^= lsb
+
+class TableBuilder:
+    '''
+    Retrograde analysis of one material:
+    1- every position is set up on a GameLogic, illegal ones are marked, checkmates are the losses in 0 plies, and
+       the moves that leave the table (captures, promotions) are looked up in the smaller tables
+    2- going back from the positions found at ply n (by un-making moves), the positions that can move into a loss
+       are wins at ply n+1 and the positions whose moves all go to wins are losses at ply n+1
+    3- what is left is drawn
+    '''
+    def __init__(self,name,tablebase,log=None):
+        self.pieces = parseMaterial(name)
+        self.name = materialName(self.pieces)
+        self.tablebase = tablebase
+        self.log = log
+        n = len(self.pieces)
+        self.weights = [64 ** (n - 1 - i) for i in range(n)]
+        self.half = 64 ** n # positions with white to move, black to move ones come after them
+        self.size = 2 * self.half
+        self.values = bytearray(self.size) # the table, DRAW_BYTE until a result is found
+        self.remaining = bytearray(self.size) # moves inside the table not known to lose yet
+        self.lossPlies = bytearray(self.size) # longest win of the opponent seen so far
+        self.noLoss = bytearray(self.size) # 1 if the position has a move to a draw or a loss of the opponent
+        self.buckets = {} # ply -> positions found at that ply (the first time a position is taken decides it)
+
+    def report(self,text):
+        if self.log is not None:
+            self.log(text)
+
+    def build(self):
+        start = time.perf_counter()
+        self.initialPass()
+        self.report('{}: positions set up in {:.1f}s'.format(self.name,time.perf_counter() - start))
+        self.retrograde()
+        self.report('{}: built in {:.1f}s'.format(self.name,time.perf_counter() - start))
+        return self.values
+
+    def addToBucket(self,ply,index):
+        if ply > MAX_DTM:
+            raise ValueError('distance to mate too long for a tablebase byte')
+        self.buckets.setdefault(ply,[]).append(index)
+
+    def initialPass(self):
+        gl = GameLogic('k7/8/8/8/8/8/8/7K w - - 0 1') # no castling rights or en-passant, the board is emptied below
+        gl.underPromotions = True
+        board = gl.board
+        board[0][0] = board[7][7] = '--'
+        pieces = self.pieces
+        values, remaining, lossPlies, noLoss = self.values, self.remaining, self.lossPlies, self.noLoss
+        whiteKing, blackKing = pieces.index('wK'), pieces.index('bK')
+        pawns = [i for i, piece in enumerate(pieces) if piece[1] == 'p']
+        for base, squares in enumerate(itertools.product(range(64),repeat=len(pieces))):
+            if (len(set(squares)) < len(squares) or KING_ATTACKS[squares[whiteKing]] >> squares[blackKing] & 1
+                    or any(squares[i] < 8 or squares[i] >= 56 for i in pawns)):
+                values[base] = values[self.half + base] = ILLEGAL_BYTE
+                continue
+            for piece, sq in zip(pieces,squares):
+                board[sq >> 3][sq & 7] = piece
+            gl.whiteKingLocation = (squares[whiteKing] >> 3,squares[whiteKing] & 7)
+            gl.blackKingLocation = (squares[blackKing] >> 3,squares[blackKing] & 7)
+            for index, whiteToMove in ((base,True),(self.half + base,False)):
+                gl.whiteToMove = not whiteToMove # the side that just moved can't be in check
+                if gl.inCheck():
+                    values[index] = ILLEGAL_BYTE
+                    continue
+                gl.whiteToMove = whiteToMove
+                moves = gl.generateValidMoves()
+                if not moves:
+                    if gl.inCheck():
+                        self.addToBucket(0,index)
+                    else:
+                        noLoss[index] = 1 # stalemate
+                    continue
+                inside = 0
+                fastestWin = None
+                for move in moves:
+                    if move.pieceCaptured == '--' and not move.isPawnPromotion:
+                        inside += 1
+                        continue
+                    gl.make_move(move)
+                    found = self.tablebase.probe(gl)
+                    gl.undo_move()
+                    if found is None:
+                        raise ValueError('{} needs the table of {}'.format(self.name,gl.to_fen()))
+                    result, plies = found
+                    if result == LOSS: # we win by going there
+                        noLoss[index] = 1
+                        if fastestWin is None or plies + 1 < fastestWin:
+                            fastestWin = plies + 1
+                    elif result == DRAW:
+                        noLoss[index] = 1
+                    elif plies > lossPlies[index]:
+                        lossPlies[index] = plies
+                remaining[index] = inside
+                if fastestWin is not None:
+                    self.addToBucket(fastestWin,index)
+                elif inside == 0 and not noLoss[index]: # every move leaves the table into a win of the opponent
+                    self.addToBucket(lossPlies[index] + 1,index)
+            for sq in squares:
+                board[sq >> 3][sq & 7] = '--'
+
+    ''' the positions that reach the position index with one move'''
+    def parents(self,index):
+        pieces, weights = self.pieces, self.weights
+        blackToMove = index >= self.half
+        base = index - self.half if blackToMove else index
+        squares = []
+        rest = base
+        for weight in weights:
+            squares.append(rest // weight)
+            rest %= weight
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        mover = 'w' if blackToMove else 'b' # the side that made the last move
+        parentBase = 0 if blackToMove else self.half
+        for i, piece in enumerate(pieces):
+            if piece[0] != mover:
+                continue
+            sq = squares[i]
+            without = parentBase + base - sq * weights[i]
+            for origin in originSquares(piece,sq,occupied):
+                yield without + origin * weights[i]
+
+    def retrograde(self):
+        values, remaining, lossPlies, noLoss = self.values, self.remaining, self.lossPlies, self.noLoss
+        ply = 0
+        while self.buckets:
+            found = self.buckets.pop(ply,[])
+            win = ply & 1
+            for index in found:
+                if values[index]:
+                    continue # decided at an earlier ply
+                values[index] = ply + 1
+                for parent in self.parents(index):
+                    if values[parent]:
+                        continue
+                    if not win: # the parent can move into our loss
+                        self.addToBucket(ply + 1,parent)
+                    else:
+                        remaining[parent] -= 1
+                        if ply > lossPlies[parent]:
+                            lossPlies[parent] = ply
+                        if remaining[parent] == 0 and not noLoss[parent]:
+                            self.addToBucket(lossPlies[parent] + 1,parent)
+            if found:
+                self.report('{}: ply {}, {} positions'.format(self.name,ply,len(found)))
+            ply += 1
+
+''' build the table of a material (and the smaller tables it needs) unless the file exists, returns its path'''
+def buildTable(name,directory=DEFAULT_DIRECTORY,log=None):
+    name = materialName(parseMaterial(name))
+    if name != canonicalName(parseMaterial(name)):
+        raise ValueError('{} is probed in the table of {}'.format(name,canonicalName(parseMaterial(name))))
+    path = tablePath(directory,name)
+    if os.path.exists(path):
+        return path
+    for sub in subMaterials(name):
+        if not isDrawnMaterial(sub):
+            buildTable(sub,directory,log)
+    os.makedirs(directory,exist_ok=True)
+    with Tablebase(directory) as tablebase:
+        builder = TableBuilder(name,tablebase,log)
+        values = builder.build()
+    with open(path + '.tmp','wb') as f:
+        f.write(HEADER.pack(MAGIC,VERSION,len(builder.pieces),name.encode(),len(values)))
+        f.write(values)
+    os.replace(path + '.tmp',path) # a build that stops half way leaves no table behind
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or probe endgame tablebases')
+    commands = parser.add_subparsers(dest='command',required=True)
+    build = commands.add_parser('build',help='build tables (and the smaller ones they need)')
+    build.add_argument('materials',nargs='*',default=list(DEFAULT_TABLES),help='e.g. KQK KRK KPK KQKR')
+    build.add_argument('--dir',default=DEFAULT_DIRECTORY)
+    probe = commands.add_parser('probe',help='print the result and the best move of a position')
+    probe.add_argument('fen')
+    probe.add_argument('--dir',default=DEFAULT_DIRECTORY)
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        for name in args.materials:
+            print(buildTable(name,args.dir,log=print))
+        return 0
+    gl = GameLogic(args.fen)
+    gl.underPromotions = True
+    with Tablebase(args.dir) as tablebase:
+        found = tablebase.probe(gl)
+        if found is None:
+            print('not in the tablebases')
+            return 1
+        result, plies = found
+        print({WIN:'win',DRAW:'draw',LOSS:'loss'}[result] + (' in {} plies'.format(plies) if result != DRAW else ''))
+        best = tablebase.bestMove(gl)
+        if best is not None:
+            print('best move', gl.getSAN(best[0]))
+    return 0
+
+if __name__ == '__main__':sys.exit(main())
@@ -0,0 +1,223 @@
+'''
+Headless engine: a UCI style text protocol over GameLogic on stdin/stdout, no pygame needed.
+Lets the engine run on servers without a display and under tournament managers that speak UCI.
+
+commands:
+    uci, isready, ucinewgame, quit
+    position startpos|fen <FEN> [moves e2e4 e7e5 ...]
+    go [depth N] [movetime MS] [nodes N] [wtime MS btime MS winc MS binc MS movestogo N] [infinite]
+                                                       (searches in the background, prints info lines and bestmove)
+    go perft N / perft N                               (node count under every move, then the total)
+    stop                                               (ends the search, bestmove is printed, go infinite waits for it)
+    d                                                  (prints the FEN of the position)
+
+usage: python ChessUCI.py [--backend mailbox|bitboard] [--book book.bin] [--tablebase tablebases]
+'''
+import argparse
+import sys
+import threading
+import time
+import ChessEngine
+import ChessAI
+
+ENGINE_NAME = 'Chess'
+DEFAULT_DEPTH = 5
+INFINITE_DEPTH = ChessAI.MAX_PLY - 1
+GO_VALUES = ('depth','movetime','nodes','wtime','btime','winc','binc','movestogo') # go options followed by a number
+
+class UCIEngine:
+    def __init__(self,logicClass=ChessEngine.GameLogic,out=sys.stdout,book=None,tablebase=None):
+        self.logicClass = logicClass
+        self.book = book # ChessBook.OpeningBook, its moves are played without searching
+        self.tablebase = tablebase # ChessTablebase.Tablebase, endgames in its tables are played from them
+        self.out = out
+        self.outLock = threading.Lock() # the search thread prints too
+        self.gl = self.newLogic(ChessEngine.STARTING_FEN)
+        self.search = None
+        self.searchThread = None
+        self.searchFen = None # FEN of the position being searched, the search thread makes moves on self.gl
+        self.searchInfinite = False # go infinite: bestmove waits for stop
+        self.stopped = threading.Event() # set by stop
+
+    def newLogic(self,fen):
+        gl = self.logicClass(fen)
+        gl.underPromotions = True
+        return gl
+
+    def send(self,line):
+        with self.outLock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    ''' run one command line, returns False on quit'''
+    def handle(self,line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'quit':
+            self.stop()
+            return False
+        if command == 'uci':
+            self.send('id name ' + ENGINE_NAME)
+            self.send('id author ' + ENGINE_NAME + ' developers')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.stop()
+            self.gl = self.newLogic(ChessEngine.STARTING_FEN)
+        elif command == 'position':
+            self.stop()
+            self.position(args)
+        elif command == 'go':
+            self.go(args)
+        elif command == 'perft':
+            self.perft(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'd':
+            self.send(self.searchFen if self.searchThread is not None else self.gl.to_fen())
+        else:
+            self.send('info string unknown command ' + command)
+        return True
+
+    ''' position startpos|fen <6 fields> [moves ...]'''
+    def position(self,args):
+        try:
+            if 'moves' in args:
+                split = args.index('moves')
+                setup, moves = args[:split], args[split + 1:]
+            else:
+                setup, moves = args, []
+            if setup[:1] == ['startpos']:
+                gl = self.newLogic(ChessEngine.STARTING_FEN)
+            elif setup[:1] == ['fen']:
+                gl = self.newLogic(' '.join(setup[1:]))
+            else:
+                raise ValueError('position needs startpos or fen')
+            for notation in moves:
+                for move in gl.getValidMoves():
+                    if move.getChessNotation() == notation:
+                        gl.make_move(move)
+                        break
+                else:
+                    raise ValueError('invalid move ' + notation)
+        except (ValueError,IndexError,KeyError) as error:
+            self.send('info string {}'.format(error))
+            return
+        self.gl = gl
+
+    def go(self,args):
+        self.stop()
+        if 'perft' in args:
+            self.perft(args[args.index('perft') + 1:])
+            return
+        options = {}
+        i = 0
+        while i < len(args):
+            if args[i] in GO_VALUES:
+                try:
+                    options[args[i]] = int(args[i + 1])
+                    i += 2
+                except (ValueError,IndexError): # leave the option out, the next token is read on its own
+                    self.send('info string {} needs a number'.format(args[i]))
+                    i += 1
+            else:
+                options[args[i]] = True
+                i += 1
+        timeLimit = options['movetime'] / 1000 if 'movetime' in options else None
+        clock = options.get('wtime' if self.gl.whiteToMove else 'btime')
+        if timeLimit is None and clock is not None: # a share of the time left on the clock
+            increment = options.get('winc' if self.gl.whiteToMove else 'binc',0)
+            timeLimit = max(clock / options.get('movestogo',30) + increment / 2,10) / 1000
+            timeLimit = min(timeLimit,clock / 2000)
+        nodeLimit = options.get('nodes')
+        if self.book is not None and 'infinite' not in options:
+            move = self.book.choose(self.gl)
+            if move is not None:
+                self.send('info string book move')
+                self.send('bestmove ' + move.getChessNotation())
+                return
+        depth = options.get('depth',DEFAULT_DEPTH if timeLimit is None and nodeLimit is None and 'infinite' not in options else INFINITE_DEPTH)
+        self.search = ChessAI.Search(self.gl,min(depth,INFINITE_DEPTH),timeLimit,nodeLimit,self.tablebase)
+        self.search.onDepth = self.info
+        self.searchFen = self.gl.to_fen()
+        self.searchInfinite = 'infinite' in options
+        self.stopped.clear()
+        self.searchThread = threading.Thread(target=self.runSearch,args=(self.search,self.searchInfinite),daemon=True)
+        self.searchThread.start()
+
+    def runSearch(self,search,infinite=False):
+        result = search.findBestMove()
+        if infinite: # the search can end on its own (a mate found), bestmove still waits for stop
+            self.stopped.wait()
+        self.send('bestmove ' + (result.bestMove.getChessNotation() if result.bestMove else '0000'))
+
+    def info(self,result):
+        if abs(result.score) >= ChessAI.CHECKMATE - ChessAI.MAX_PLY:
+            plies = ChessAI.CHECKMATE - abs(result.score)
+            score = 'mate {}'.format((plies + 1) // 2 if result.score > 0 else -(plies // 2))
+        else:
+            score = 'cp {}'.format(result.score)
+        self.send('info depth {} score {} nodes {} nps {} time {} pv {}'.format(
+            result.depth,score,result.nodes,int(result.nps),int(result.seconds * 1000),
+            ' '.join(move.getChessNotation() for move in result.pv)))
+
+    ''' stop the search in progress (if any) and wait for its bestmove'''
+    def stop(self):
+        if self.searchThread is not None:
+            self.search.stop()
+            self.stopped.set()
+            self.searchThread.join()
+            self.searchThread = None
+            self.search = None
+
+    def perft(self,args):
+        self.stop()
+        try:
+            depth = int(args[0])
+        except (IndexError,ValueError):
+            self.send('info string perft needs a depth')
+            return
+        start = time.perf_counter()
+        split = self.gl.divide(depth) if depth > 0 else {}
+        for notation in sorted(split):
+            self.send('{}: {}'.format(notation,split[notation]))
+        nodes = sum(split.values()) if depth > 0 else 1
+        elapsed = time.perf_counter() - start
+        self.send('')
+        self.send('Nodes searched: {}'.format(nodes))
+        self.send('info string {:.0f} nodes/s'.format(nodes / elapsed if elapsed else 0))
+
+    def loop(self,stream=sys.stdin):
+        for line in stream:
+            if not self.handle(line):
+                return
+        if self.searchThread is not None: # end of input: let the last search finish, an infinite one never would
+            if not self.searchInfinite:
+                self.searchThread.join()
+            self.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='UCI style engine on stdin/stdout')
+    parser.add_argument('--backend',choices=['mailbox','bitboard'],default='mailbox')
+    parser.add_argument('--book',help='opening book file (made with ChessBook.py build)')
+    parser.add_argument('--tablebase',help='endgame tablebase directory (made with ChessTablebase.py build)')
+    args = parser.parse_args(argv)
+    logicClass = ChessEngine.GameLogic
+    if args.backend == 'bitboard':
+        import ChessBitboard # only loaded when asked for
+        logicClass = ChessBitboard.BitboardGameLogic
+    book = None
+    if args.book:
+        import ChessBook
+        book = ChessBook.OpeningBook(args.book)
+    tablebase = None
+    if args.tablebase:
+        import ChessTablebase
+        tablebase = ChessTablebase.Tablebase(args.tablebase)
+    UCIEngine(logicClass,book=book,tablebase=tablebase).loop()
+    return 0
+
+if __name__ == '__main__':sys.exit(main())